@@ -6,49 +6,98 @@ It replaces gene_id filed with IDs provided in a separate gene table (transcID \
 '''
 
 import argparse
-from collections import defaultdict
+import gzip
+import re
+import sys
+from site_reader import open_input
+
+
+## One attribute: key "value" (gtf) or key=value (gff)
+ATTRIBUTE_RE = re.compile(r'\s*([^\s=;"]+)(?:\s+|=)(?:"([^"]*)"|([^;]*?))\s*(?:;|$)')
+
+
+def open_text(file_name, mode='r'):
+	## Opens a text file: input plain, gzipped or bgzipped, output plain or gzipped (.gz); - is stdin/stdout
+
+	if mode == 'r':
+		return open_input(file_name, 'rt')
+	if file_name == '-':
+		return open(sys.stdout.fileno(), mode, buffering=1024 * 1024, closefd=False)
+	if file_name.endswith('.gz'):
+		return gzip.open(file_name, mode + 't')
+	return open(file_name, mode, buffering=1024 * 1024)
 
 
 def read_isoforms(isoforms):
 	## Reads file transcriptID \t geneID into a dict
 
 	iso_dict = {}
-	with open(isoforms, 'r') as inf:
-		for line in inf.readlines():
-			transc = line.split()[0]
-			gene = line.split()[1]
-			iso_dict[transc] = gene
+	with open_text(isoforms) as inf:
+		for line in inf:
+			fields = line.split()
+			if len(fields) >= 2:
+				iso_dict[fields[0]] = fields[1]
 	return iso_dict
 
 
-def assign_geneid_to_gtf(annogtf, iso_dict):
-	## Reads a 9-field gtf file;
-	## replaces gene_id field with geneIDs from the isoform dict
+def parse_attributes(attributes):
+	## Parses attribute column of gtf/gff once;
+	## returns a dict: key -> (value, start and end of the value in the column)
+
+	parsed = {}
+	for match in ATTRIBUTE_RE.finditer(attributes):
+		group = 2 if match.group(2) is not None else 3
+		parsed.setdefault(match.group(1), (match.group(group), match.start(group), match.end(group)))
+	return parsed
+
+
+def rewrite_attribute(line, key, target, mapping):
+	## Replaces value of the target attribute with mapping[value of key attribute];
+	## lines without the key or with a key not in the mapping are returned as they are
+
+	if line.startswith('#'):
+		return line
+	fields = line.rstrip('\n').split('\t')
+	if len(fields) < 9:
+		return line
+
+	attributes = fields[8]
+	parsed = parse_attributes(attributes)
+	if (key not in parsed) or (parsed[key][0] not in mapping):
+		return line
+	new_value = mapping[parsed[key][0]]
+
+	if target in parsed:
+		_, start, end = parsed[target]
+		attributes = attributes[:start] + new_value + attributes[end:]
+	elif '=' in attributes.split(';')[0]:
+		attributes = '{};{}={}'.format(attributes.rstrip(';'), target, new_value)
+	else:
+		attributes = attributes.rstrip()
+		if attributes and not attributes.endswith(';'):
+			attributes += ';'
+		attributes = '{}{}{} "{}";'.format(attributes, ' ' if attributes else '', target, new_value)
+	fields[8] = attributes
+	return '\t'.join(fields) + '\n'
 
-	with open(annogtf, 'r') as inf:
-		for line in inf.readlines():
-			parts_to_keep = '\t'.join(line.split('\t')[:-1])
-			transc_info = line.split('\t')[-1].rstrip('\n')
 
-			if transc_info.startswith('gene_id'):
-				transc_info_to_keep = ';'.join(transc_info.split(';')[1:])
-				gene_id_field = transc_info.split(';')[0]
-				gene_id = gene_id_field.replace(' gene_id ', '').strip('"')
-				transc_id_field = transc_info.split(';')[1]
-				transc_id = transc_id_field.replace(' transcript_id ', '').strip('"')
+def assign_geneid_to_gtf(annogtf, iso_dict, output='-', key='transcript_id', target='gene_id'):
+	## Streams a 9-field gtf/gff file (plain, gzipped or bgzipped);
+	## replaces target attribute (gene_id) with IDs from the isoform dict, looked up by key attribute (transcript_id);
+	## all other lines are written unchanged
 
-				if transc_id in iso_dict:
-					new_gene_id = iso_dict[transc_id]
-				else:
-					new_gene_id = gene_id	
-				new_gtf_line = '{}\tgene_id "{}";{}'.format(parts_to_keep, new_gene_id, transc_info_to_keep)
-				print(new_gtf_line)
+	with open_text(annogtf) as inf, open_text(output, 'w') as outf:
+		for line in inf:
+			outf.write(rewrite_attribute(line, key, target, iso_dict))
 
 
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-a', '--annogtf', type=str, help='annotation file in gtf format')
 	parser.add_argument('-i', '--isoforms', type=str, help='isoforms file: transcriptID \t geneID')
+	parser.add_argument('-o', '--output', type=str, default='-', help='output gtf file (.gz to compress); default: stdout')
+	parser.add_argument('-k', '--key', type=str, default='transcript_id', help='attribute to look up in the isoforms file; default: transcript_id')
+	parser.add_argument('-t', '--target', type=str, default='gene_id', help='attribute to replace; default: gene_id')
 	args = parser.parse_args()
 
 	## Parse arguments
@@ -59,7 +108,7 @@ def main():
 	iso_dict = read_isoforms(isoforms)
 
 	## Output new gtf file with geneIDs
-	assign_geneid_to_gtf(annogtf, iso_dict)
+	assign_geneid_to_gtf(annogtf, iso_dict, args.output, args.key, args.target)
 
 
 if __name__ == "__main__":
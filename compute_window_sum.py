@@ -5,12 +5,410 @@
 
 
 import argparse
+from collections import deque
+from multiprocessing import Pool
 from operator import itemgetter
+import os
+import sys
+import numpy as np
+from site_reader import block_columns, is_plain_file, open_input, read_blocks
 
 
 __author__ = "Ekaterina Osipova, 2023."
 
 
+def parse_block(block, check_columns, position_columns):
+    ## Parses only the requested columns of a block of lines and returns
+    ## a (lines x columns) float array of values and the array of coordinates per line
+
+    fields = block_columns(block, check_columns + position_columns)
+    values = fields[:, :len(check_columns)].astype(float)
+    coordinates = fields[:, len(check_columns):]
+    return values, coordinates
+
+
+def find_line_starts(filein, chunk_size):
+    ## Splits a file into byte ranges of about chunk_size;
+    ## returns range bounds moved forward to the next line start
+
+    file_size = os.path.getsize(filein)
+    bounds = [0]
+    with open(filein, 'rb') as inf:
+        for offset in range(chunk_size, file_size, chunk_size):
+            if offset <= bounds[-1]:
+                continue
+            inf.seek(offset - 1)
+            inf.readline()
+            if inf.tell() < file_size:
+                bounds.append(inf.tell())
+    bounds.append(file_size)
+    return bounds
+
+
+def sum_line_values(values):
+    ## Sums values of each line over the requested columns;
+    ## columns are added one by one, in the same order as python sum()
+
+    line_totals = np.zeros(values.shape[0])
+    for c in range(values.shape[1]):
+        line_totals += values[:, c]
+    return line_totals
+
+
+def read_sites(filein, buffer_size, check_columns, position_columns, start=0, end=None, threads=1):
+    ## Yields (chrom, position, value) for every line of the input (or its byte range);
+    ## value is the sum over the requested columns
+
+    for block in read_blocks(filein, buffer_size, start, end, threads):
+        values, coordinates = parse_block(block, check_columns, position_columns)
+        chroms = [c.decode() for c in coordinates[:, 0]]
+        positions = coordinates[:, 1].astype(np.int64).tolist()
+        yield from zip(chroms, positions, sum_line_values(values).tolist())
+
+
+def bp_windows(sites, window, step):
+    ## Slides windows of <window> bp by <step> bp over position-sorted sites;
+    ## starts over at every new contig and yields (chrom, start, end, sum, count, min, max)
+    ## for every window up to the last one containing a site of the contig (BED coordinates).
+    ## Sum and count are running accumulators and min/max are kept in monotonic deques,
+    ## so the cost per site does not depend on how much windows overlap.
+    ## Sites with nan values are not informative: they move windows but are not counted
+
+    chrom_current = None
+    position_previous = 0
+    seen_chroms = set()
+    window_sites = deque()
+    min_sites = deque()
+    max_sites = deque()
+    window_sum = 0.0
+    window_start = 0
+
+    def close_window():
+        # drop sites that are left of the window; report the window
+        nonlocal window_sum
+        while window_sites and window_sites[0][0] <= window_start:
+            window_sum -= window_sites.popleft()[1]
+        while min_sites and min_sites[0][0] <= window_start:
+            min_sites.popleft()
+        while max_sites and max_sites[0][0] <= window_start:
+            max_sites.popleft()
+        if not window_sites:
+            window_sum = 0.0
+        count = len(window_sites)
+        if count:
+            return (chrom_current, window_start, window_start + window,
+                    window_sum, count, min_sites[0][1], max_sites[0][1])
+        return (chrom_current, window_start, window_start + window, 0.0, 0, None, None)
+
+    for chrom, position, value in sites:
+        if chrom != chrom_current:
+            ## new contig: report the rest of the previous one and start over
+            if chrom in seen_chroms:
+                raise ValueError('input is not grouped by contig: {} is split'.format(chrom))
+            while chrom_current is not None and window_start < position_previous:
+                yield close_window()
+                window_start += step
+            seen_chroms.add(chrom)
+            chrom_current = chrom
+            position_previous = 0
+            window_sites.clear()
+            min_sites.clear()
+            max_sites.clear()
+            window_sum = 0.0
+            window_start = 0
+
+        if position < position_previous:
+            raise ValueError('input is not sorted by position: {}\t{}'.format(chrom, position))
+        position_previous = position
+
+        ## report all windows that end before this site
+        while window_start + window < position:
+            yield close_window()
+            window_start += step
+
+        ## add informative site to the accumulators
+        if (position > window_start) and (value == value):
+            window_sites.append((position, value))
+            window_sum += value
+            while min_sites and min_sites[-1][1] >= value:
+                min_sites.pop()
+            min_sites.append((position, value))
+            while max_sites and max_sites[-1][1] <= value:
+                max_sites.pop()
+            max_sites.append((position, value))
+
+    ## report the rest of the last contig, including the trailing partial window
+    while chrom_current is not None and window_start < position_previous:
+        yield close_window()
+        window_start += step
+
+
+def compute_window_stats_bp(args, check_columns, position_columns):
+    ## Computes sum, mean, count of informative sites, min and max
+    ## in windows of <window> bp sliding by <step> bp within every contig
+
+    if len(position_columns) != 2:
+        raise ValueError('--units bp needs two position columns: chrom,position')
+    step = args.step if args.step else args.window
+    sites = read_sites(args.input, args.buffer_size * 1024 * 1024, check_columns, position_columns, threads=args.decompress_threads)
+
+    print('#chrom\tstart\tend\tsum\tmean\tcount\tmin\tmax')
+    sys.stdout.write(format_bp_windows(bp_windows(sites, args.window, step)))
+
+
+def format_bp_windows(windows):
+    ## Formats bp windows: chrom \t start \t end \t sum \t mean \t count \t min \t max
+
+    output_lines = []
+    for chrom, start, end, window_sum, count, value_min, value_max in windows:
+        if count:
+            output_lines.append('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                chrom, start, end, window_sum, window_sum / count, count, value_min, value_max))
+        else:
+            output_lines.append('{}\t{}\t{}\t0.0\tNA\t0\tNA\tNA\n'.format(chrom, start, end))
+    return ''.join(output_lines)
+
+
+def find_contig_runs(task):
+    ## Returns (chrom, start byte, end byte) for runs of lines of the same contig in a byte range
+
+    filein, start, end, buffer_size, position_columns = task
+    runs = []
+    offset = start
+    for block in read_blocks(filein, buffer_size, start, end):
+        _, coordinates = parse_block(block, [], position_columns[:1])
+        chroms = coordinates[:, 0]
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        if len(newlines) != len(chroms):
+            raise ValueError('cannot split input into contigs: unexpected line breaks')
+        change = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        run_starts = np.concatenate(([0], newlines[change - 1] + 1))
+        run_ends = np.concatenate((newlines[change - 1] + 1, [len(block)]))
+        for i, run_start, run_end in zip(np.concatenate(([0], change)).tolist(), run_starts.tolist(), run_ends.tolist()):
+            runs.append((chroms[i].decode(), offset + run_start, offset + run_end))
+        offset += len(block)
+    return runs
+
+
+def bp_windows_in_range(task):
+    ## Computes and formats bp windows of the sites of one contig from its byte range
+
+    filein, start, end, buffer_size, check_columns, position_columns, window, step = task
+    sites = read_sites(filein, buffer_size, check_columns, position_columns, start, end)
+    return format_bp_windows(bp_windows(sites, window, step))
+
+
+def compute_window_stats_bp_parallel(args, check_columns, position_columns):
+    ## Same as compute_window_stats_bp, with contigs processed in parallel:
+    ## the input is scanned in byte ranges for contig boundaries,
+    ## then every contig is reduced by a worker and written in the input order
+
+    if len(position_columns) != 2:
+        raise ValueError('--units bp needs two position columns: chrom,position')
+    step = args.step if args.step else args.window
+    buffer_size = args.buffer_size * 1024 * 1024
+    bounds = find_line_starts(args.input, buffer_size)
+
+    with Pool(args.threads) as pool:
+        ## merge runs of lines into contigs
+        contigs = []
+        seen_chroms = set()
+        range_tasks = [(args.input, start, end, buffer_size, position_columns) for start, end in zip(bounds[:-1], bounds[1:])]
+        for runs in pool.imap(find_contig_runs, range_tasks):
+            for chrom, start, end in runs:
+                if contigs and contigs[-1][0] == chrom:
+                    contigs[-1][2] = end
+                elif chrom in seen_chroms:
+                    raise ValueError('input is not grouped by contig: {} is split'.format(chrom))
+                else:
+                    seen_chroms.add(chrom)
+                    contigs.append([chrom, start, end])
+
+        ## reduce contigs
+        print('#chrom\tstart\tend\tsum\tmean\tcount\tmin\tmax')
+        sys.stdout.flush()
+        contig_tasks = [
+                        (args.input, start, end, buffer_size, check_columns, position_columns, args.window, step)
+                        for _, start, end in contigs
+                        ]
+        for output in pool.imap(bp_windows_in_range, contig_tasks):
+            sys.stdout.write(output)
+
+
+def compute_window_sum_python(args, check_columns, position_columns):
+    ## Reference line-by-line implementation: sum or mean over every <window> lines
+
+    window = args.window
+    line_count = 1
+    window_value = 0
+
+    with open_input(args.input, 'rt', args.decompress_threads) as inf:
+        for line in inf:
+
+            if len(check_columns) == 1:
+                line_values = float(line.split()[check_columns[0]])
+                line_total = line_values
+            elif len(check_columns) > 1:
+                line_values = [float(i) for i in itemgetter(*check_columns)(line.split())]
+                line_total = sum(line_values)
+
+            if len(position_columns) == 1:
+                coordinate = line.split()[position_columns[0]]
+            elif len(position_columns) > 1:
+                coordinate = '\t'.join([i for i in itemgetter(*position_columns)(line.split())])
+
+            if args.mean:
+                window_value += line_total / window
+            else:
+                window_value += line_total
+
+            ## check if we went beyond the window
+            if line_count >= window:
+                print('{}\t{}'.format(coordinate, window_value))
+                line_count = 0
+                window_value = 0
+            line_count += 1
+
+
+def get_line_totals(block, check_columns, position_columns, window, mean):
+    ## Parses a block of lines; returns the value of each line
+    ## (divided by window size for mean) and the coordinates of each line
+
+    values, coordinates = parse_block(block, check_columns, position_columns)
+    line_totals = sum_line_values(values)
+    if mean:
+        line_totals /= window
+    return line_totals, coordinates
+
+
+def reduce_line_windows(line_totals, coordinates, window, window_value, line_count):
+    ## Adds a block of line values to windows of <window> lines;
+    ## window_value and line_count describe the window left open by the previous block.
+    ## Returns finished windows as (coordinate, value) and the new open window
+
+    # first, finish the window left open by the previous block
+    start = min(window - line_count, len(line_totals))
+    window_value = np.cumsum(np.concatenate(([window_value], line_totals[:start])))[-1]
+    line_count += start
+    output_lines = []
+    if line_count == window:
+        output_lines.append((coordinates[start - 1], window_value))
+        window_value = 0.0
+        line_count = 0
+
+    # then all full windows of this block at once
+    n_windows = (len(line_totals) - start) // window
+    end = start + n_windows * window
+    if n_windows:
+        window_values = np.cumsum(line_totals[start:end].reshape(n_windows, window), axis=1)[:, -1]
+        window_coordinates = coordinates[start + window - 1:end:window]
+        output_lines.extend(zip(window_coordinates, window_values.tolist()))
+
+    # and keep the tail open for the next block
+    if end < len(line_totals):
+        window_value = np.cumsum(np.concatenate(([0.0], line_totals[end:])))[-1]
+        line_count = len(line_totals) - end
+    return output_lines, window_value, line_count
+
+
+def format_line_windows(output_lines):
+    ## Formats windows of lines: coordinates \t value
+
+    return ''.join(
+                   '{}\t{}\n'.format('\t'.join(c.decode() for c in coordinate), float(value))
+                   for coordinate, value in output_lines
+                   )
+
+
+def compute_window_sum_numpy(args, check_columns, position_columns):
+    ## Block-wise implementation: parses blocks of lines into arrays
+    ## and reduces them window by window; only the unfinished window is carried over.
+    ## Values are accumulated in the same order as in the python engine,
+    ## so the output is identical
+
+    window_value = 0.0
+    line_count = 0
+
+    for block in read_blocks(args.input, args.buffer_size * 1024 * 1024, threads=args.decompress_threads):
+        line_totals, coordinates = get_line_totals(block, check_columns, position_columns, args.window, args.mean)
+        output_lines, window_value, line_count = reduce_line_windows(
+                                                                     line_totals, coordinates, args.window,
+                                                                     window_value, line_count
+                                                                     )
+        sys.stdout.write(format_line_windows(output_lines))
+
+
+def count_lines_in_range(task):
+    ## Counts lines in a byte range of a file
+
+    filein, start, end, buffer_size = task
+    return sum(block.count(b'\n') for block in read_blocks(filein, buffer_size, start, end))
+
+
+def line_windows_in_range(task):
+    ## Reduces a byte range of a file starting at line number first_line.
+    ## Lines before the first window boundary belong to a window opened in a previous range:
+    ## their values are returned as head for the caller to finish that window.
+    ## Returns head values, coordinate of the last head line,
+    ## formatted finished windows and the window left open at the end of the range
+
+    filein, start, end, first_line, buffer_size, check_columns, position_columns, window, mean = task
+    head_left = (window - first_line % window) % window
+    head = []
+    head_coordinate = None
+    output = []
+    window_value = 0.0
+    line_count = 0
+
+    for block in read_blocks(filein, buffer_size, start, end):
+        line_totals, coordinates = get_line_totals(block, check_columns, position_columns, window, mean)
+        if head_left:
+            n_head = min(head_left, len(line_totals))
+            head.append(line_totals[:n_head])
+            head_coordinate = coordinates[n_head - 1]
+            head_left -= n_head
+            line_totals = line_totals[n_head:]
+            coordinates = coordinates[n_head:]
+        output_lines, window_value, line_count = reduce_line_windows(
+                                                                     line_totals, coordinates, window,
+                                                                     window_value, line_count
+                                                                     )
+        output.append(format_line_windows(output_lines))
+    head = np.concatenate(head) if head else np.zeros(0)
+    return head, head_coordinate, ''.join(output), window_value, line_count
+
+
+def compute_window_sum_parallel(args, check_columns, position_columns):
+    ## Same as compute_window_sum_numpy, with byte ranges of the input reduced in parallel:
+    ## lines are counted per range first to place window boundaries,
+    ## then windows split between ranges are finished here in the serial order
+
+    buffer_size = args.buffer_size * 1024 * 1024
+    bounds = find_line_starts(args.input, buffer_size)
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+
+    with Pool(args.threads) as pool:
+        line_counts = pool.map(count_lines_in_range, [(args.input, start, end, buffer_size) for start, end in ranges])
+        first_lines = np.concatenate(([0], np.cumsum(line_counts)[:-1])).tolist()
+        tasks = [
+                 (args.input, start, end, first_line, buffer_size, check_columns, position_columns, args.window, args.mean)
+                 for (start, end), first_line in zip(ranges, first_lines)
+                 ]
+
+        window_value = 0.0
+        line_count = 0
+        for head, head_coordinate, output, range_value, range_count in pool.imap(line_windows_in_range, tasks):
+            if len(head):
+                window_value = np.cumsum(np.concatenate(([window_value], head)))[-1]
+                line_count += len(head)
+                if line_count == args.window:
+                    sys.stdout.write(format_line_windows([(head_coordinate, window_value)]))
+                    line_count = 0
+            sys.stdout.write(output)
+            if line_count == 0:
+                window_value, line_count = range_value, range_count
+
+
 def main():
     ## Parse argument
     parser = argparse.ArgumentParser()
@@ -18,7 +416,7 @@ def main():
                         '-i',
                         '--input', 
                         type=str, 
-                        help='input file with at least a numeric column'
+                        help='input file with at least a numeric column: plain, gzip or bgzip; - for stdin'
                         )
     parser.add_argument(
                         '-w', 
@@ -47,44 +445,71 @@ def main():
                         default='1,2', 
                         help='comma-separated string of column numbers specifying coordinates'
                         )
+    parser.add_argument(
+                        '-e',
+                        '--engine',
+                        type=str,
+                        choices=['numpy', 'python'],
+                        default='numpy',
+                        help='numpy: parse input in large blocks into arrays; python: line-by-line; default=numpy'
+                        )
+    parser.add_argument(
+                        '-b',
+                        '--buffer_size',
+                        type=int,
+                        default=64,
+                        help='size of input blocks in MB for the numpy engine; default=64'
+                        )
+    parser.add_argument(
+                        '-u',
+                        '--units',
+                        type=str,
+                        choices=['lines', 'bp'],
+                        default='lines',
+                        help='lines: windows of <window> input lines; bp: windows of <window> bp within every contig \
+                        reporting sum, mean, count, min and max of informative sites; default=lines'
+                        )
+    parser.add_argument(
+                        '-s',
+                        '--step',
+                        type=int,
+                        default=0,
+                        help='step in bp for sliding windows with --units bp; default=window size'
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--threads',
+                        type=int,
+                        default=1,
+                        help='number of processes: plain input is split into byte ranges (or contigs with --units bp); default=1'
+                        )
+    parser.add_argument(
+                        '-d',
+                        '--decompress_threads',
+                        type=int,
+                        default=1,
+                        help='number of threads decompressing bgzip input (read by one process); default=1'
+                        )
     args = parser.parse_args()
 
-    ## Read input line by line
-    window = args.window
-    line_count = 1
-    window_value = 0
+    ## Read input and compute window values
     check_columns = [int(c) - 1 for c in args.columns.split(',')]
     position_columns = [int(c) - 1 for c in args.position.split(',')]
 
-    with open(args.input) as inf:
-        for line in inf:
-            
-            if len(check_columns) == 1:
-                line_values = float(line.split()[check_columns[0]])
-                line_total = line_values
-            elif len(check_columns) > 1:
-                line_values = [float(i) for i in itemgetter(*check_columns)(line.split())]
-                line_total = sum(line_values)
-            
-            if len(position_columns) == 1:
-                coordinate = line.split()[position_columns[0]]
-            elif len(position_columns) > 1:
-                coordinate = '\t'.join([i for i in itemgetter(*position_columns)(line.split())])
-
-            if args.mean:
-                window_value += line_total / window
-            else:
-                window_value += line_total
-
-            ## check if we went beyond the window
-            if line_count >= window:
-                print('{}\t{}'.format(coordinate, window_value))
-                line_count = 0
-                window_value = 0
-            line_count += 1
+    ## byte ranges need a plain file; compressed input or stdin is read by one process
+    parallel = (args.threads > 1) and is_plain_file(args.input)
+    if (args.units == 'bp') and parallel:
+        compute_window_stats_bp_parallel(args, check_columns, position_columns)
+    elif args.units == 'bp':
+        compute_window_stats_bp(args, check_columns, position_columns)
+    elif parallel:
+        compute_window_sum_parallel(args, check_columns, position_columns)
+    elif args.engine == 'numpy':
+        compute_window_sum_numpy(args, check_columns, position_columns)
+    else:
+        compute_window_sum_python(args, check_columns, position_columns)
 
 
 
 if __name__ == "__main__":
     main()
-
@@ -1,16 +1,124 @@
 #!/usr/bin/env python3
 #
-# This script parses a file with position \t
-# and outputs a file with continious positions, 
-# assigning the values from the previously encoutered position  
+# This script parses a file with position \t value
+# and outputs a file with continious positions,
+# assigning the values from the previously encoutered position
 
 
 import argparse
+import heapq
+import os
+import sys
+import tempfile
+from site_reader import iter_fields
 
 
 __author__ = "Ekaterina Osipova, 2023."
 
 
+def read_map(filein):
+    ## Reads position \t value lines (plain or gzipped; - for stdin); yields (position, value)
+
+    for fields in iter_fields(filein):
+        yield int(fields[0]), fields[1].decode()
+
+
+def map_runs(records):
+    ## Takes (position, value) sorted by position; yields runs (start, end, value):
+    ## positions start..end-1 take the value of the map position start.
+    ## Runs with the same value are merged; the last map position makes a run of 1 bp
+
+    run_start = None
+    for position_curr, value_curr in records:
+        if run_start is None:
+            run_start, position_previous, value_previous = position_curr, position_curr, value_curr
+        elif position_curr > position_previous:
+            if value_curr != value_previous:
+                yield run_start, position_curr, value_previous
+                run_start = position_curr
+            position_previous = position_curr
+            value_previous = value_curr
+
+    if run_start is not None:
+        yield run_start, position_previous + 1, value_previous
+
+
+def read_genome_map(filein, columns, max_records, tmpdir):
+    ## Reads a genome-wide map (plain, gzipped or - for stdin) in one pass;
+    ## columns: chrom, position and value column indices.
+    ## Records are kept in memory per chromosome; when there are more than max_records,
+    ## every chromosome buffer is sorted and spilled to a temporary file.
+    ## Yields (chrom, sorted (position, value) records) in the order chromosomes first appear
+
+    chrom_column, position_column, value_column = columns
+    buffers = {}
+    spills = {}
+    n_records = 0
+
+    def spill():
+        for chrom, records in buffers.items():
+            if not records:
+                continue
+            records.sort(key=lambda r: r[0])
+            spill_file = os.path.join(tmpdir, '{}.{}.txt'.format(len(spills.setdefault(chrom, [])), chrom.decode()))
+            with open(spill_file, 'w') as outf:
+                outf.writelines('{}\t{}\n'.format(position, value) for position, value in records)
+            spills[chrom].append(spill_file)
+            records.clear()
+
+    for fields in iter_fields(filein):
+        if fields[0].startswith(b'#'):
+            continue
+        try:
+            position = int(fields[position_column])
+        except ValueError:
+            # header
+            continue
+        buffers.setdefault(fields[chrom_column], []).append((position, fields[value_column].decode()))
+        n_records += 1
+        if n_records >= max_records:
+            spill()
+            n_records = 0
+
+    for chrom, records in buffers.items():
+        records.sort(key=lambda r: r[0])
+        if chrom in spills:
+            ## external sort: merge sorted spill files with the rest in memory
+            yield chrom.decode(), heapq.merge(*[read_map(f) for f in spills[chrom]], records, key=lambda r: r[0])
+        else:
+            yield chrom.decode(), records
+
+
+def read_runs(filein):
+    ## Reads a file with runs: start \t end \t value (end not included)
+
+    for fields in iter_fields(filein):
+        if not fields[0].isdigit():
+            # header
+            continue
+        yield int(fields[0]), int(fields[1]), fields[2].decode()
+
+
+def write_runs(runs, out):
+    ## Writes runs: start \t end \t value
+
+    out.write('start\tend\trate\n')
+    for start, end, value in runs:
+        out.write('{}\t{}\t{}\n'.format(start, end, value))
+
+
+def expand_runs(runs, header, out, block_size=1_000_000):
+    ## Writes one position \t value line for every bp of the runs;
+    ## lines are formatted in blocks of block_size positions and written at once
+
+    out.write(header + '\n')
+    for start, end, value in runs:
+        separator = '\t{}\n'.format(value)
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            out.write(separator.join(map(str, range(block_start, block_end))) + separator)
+
+
 def main():
     ## Parse argument
     parser = argparse.ArgumentParser()
@@ -18,7 +126,7 @@ def main():
                         '-f',
                         '--filein',
                         type=str,
-                        help='input file with two columns to parse: position\t value'
+                        help='input file with two columns to parse: position\t value (plain, gzip or bgzip; - for stdin)'
                         )
     parser.add_argument(
                         '-hh',
@@ -27,28 +135,75 @@ def main():
                         default='position\trate',
                         help='a header line to add to the output; default=position\trate'
                         )
+    parser.add_argument(
+                        '-r',
+                        '--runs',
+                        action='store_true',
+                        help='specify if you want compact output: start\tend\trate runs (end not included) instead of every position'
+                        )
+    parser.add_argument(
+                        '-e',
+                        '--expand',
+                        action='store_true',
+                        help='specify if the input is a file with start\tend\trate runs to expand to every position'
+                        )
+    parser.add_argument(
+                        '-o',
+                        '--output',
+                        type=str,
+                        default='',
+                        help='output path pattern with {chrom}, like {chrom}/{chrom}.recombination_map.txt: \
+                        input is then a genome-wide map (plain or gzipped) and one file is written per chromosome'
+                        )
+    parser.add_argument(
+                        '-c',
+                        '--columns',
+                        type=str,
+                        default='1,2,4',
+                        help='comma-separated column numbers of chrom,position,rate in a genome-wide map; default=1,2,4'
+                        )
+    parser.add_argument(
+                        '-n',
+                        '--max_records',
+                        type=int,
+                        default=5_000_000,
+                        help='max number of map records to sort in memory before spilling to temporary files; default=5_000_000'
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--tmpdir',
+                        type=str,
+                        default=None,
+                        help='directory for temporary files of the external sort; default=system temp dir'
+                        )
     args = parser.parse_args()
 
-    ## Read input bed file line by line;
-    count = 0
-    print(args.header)
-    with open(args.filein) as inf:
-        for line in inf:
-            position_curr = int(line.split()[0])  
-            value_curr = line.split()[1]
-
-            if count == 0:
-            	position_previous = position_curr
-            	value_previous = 0 
-            	print('{}\t{}'.format(position_previous, value_previous))
-
-            else:
-	            if position_curr > position_previous:
-	            	for i in range(position_curr - position_previous):
-	            		print('{}\t{}'.format(position_previous + i, value_previous))
-	            	position_previous = position_curr
-	            	value_previous = value_curr
-            count += 1
+    ## Genome-wide map: one pass, one output file per chromosome
+    if args.output:
+        columns = [int(c) - 1 for c in args.columns.split(',')]
+        with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+            for chrom, records in read_genome_map(args.filein, columns, args.max_records, tmpdir):
+                output = args.output.format(chrom=chrom)
+                if os.path.dirname(output):
+                    os.makedirs(os.path.dirname(output), exist_ok=True)
+                with open(output, 'w', buffering=1024 * 1024) as outf:
+                    if args.runs:
+                        write_runs(map_runs(records), outf)
+                    else:
+                        expand_runs(map_runs(records), args.header, outf)
+        return
+
+    ## Read input as runs of positions with the same value
+    if args.expand:
+        runs = read_runs(args.filein)
+    else:
+        runs = map_runs(read_map(args.filein))
+
+    ## Output runs or every position
+    if args.runs:
+        write_runs(runs, sys.stdout)
+    else:
+        expand_runs(runs, args.header, sys.stdout)
 
 
 
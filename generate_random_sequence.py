@@ -2,36 +2,97 @@
 #
 # This script generates a nucleotide fasta sequence of a requested length.  
 import argparse
-import random
+import sys
+import numpy as np
 
 
 __author__ = "Ekaterina Osipova, 2024."
 
 
-def generate_random_fasta(sequence_length):
-    # Define the possible nucleotides
-    nucleotides = ['A', 'T', 'C', 'G']
-    fasta = ""
-    
-    # Generate a random sequence
-    sequence = ''.join(random.choice(nucleotides) for _ in range(sequence_length))
-    
-    # Wrap sequence lines to a maximum of 80 characters per line (FASTA format standard)
-    for i in range(0, len(sequence), 80):
-        fasta += sequence[i:i+80] + "\n"
-    
-    return fasta
+NUCLEOTIDES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def get_weights(gc_content, weights):
+    ## Returns probabilities of A, C, G, T: from comma-separated weights, or from GC content, or uniform
+
+    if weights:
+        weights = np.array([float(w) for w in weights.split(',')])
+        if (len(weights) != 4) or (weights < 0).any() or (weights.sum() == 0):
+            raise ValueError('weights should be 4 non-negative numbers for A,C,G,T: {}'.format(weights))
+    elif gc_content is not None:
+        if not 0 <= gc_content <= 1:
+            raise ValueError('GC content should be between 0 and 1: {}'.format(gc_content))
+        weights = np.array([1 - gc_content, gc_content, gc_content, 1 - gc_content])
+    else:
+        weights = np.ones(4)
+    return weights / weights.sum()
+
+
+def read_chrom_sizes(chrom_sizes):
+    ## Reads chrom.sizes file: contig \t length; returns a list of (contig, length)
+
+    contigs = []
+    with open(chrom_sizes) as inf:
+        for line in inf:
+            if line.startswith('#') or not line.strip():
+                continue
+            chrom, length = line.split()[:2]
+            contigs.append((chrom, int(length)))
+    return contigs
+
+
+def generate_random_fasta(out, name, sequence_length, weights, rng, line_width=80, chunk_lines=10_000):
+    ## Writes one random contig to a binary stream: bases are drawn in chunks of chunk_lines lines
+    ## into a NumPy buffer that already has a newline at the end of every line,
+    ## so memory does not depend on the sequence length
+
+    out.write('>{}\n'.format(name).encode())
+    cumulative_weights = np.cumsum(weights)
+    cumulative_weights[-1] = 1.0
+    buffer = np.empty((chunk_lines, line_width + 1), dtype=np.uint8)
+    buffer[:, -1] = ord('\n')
+
+    for chunk_start in range(0, sequence_length, chunk_lines * line_width):
+        chunk_length = min(chunk_lines * line_width, sequence_length - chunk_start)
+        bases = NUCLEOTIDES[np.searchsorted(cumulative_weights, rng.random(chunk_length), side='right')]
+
+        # full lines straight from the buffer, then the last partial line of the contig
+        n_lines = chunk_length // line_width
+        buffer[:n_lines, :-1] = bases[:n_lines * line_width].reshape(n_lines, line_width)
+        out.write(buffer[:n_lines].tobytes())
+        if chunk_length % line_width:
+            out.write(bases[n_lines * line_width:].tobytes() + b'\n')
 
 
 def main():
     parser = argparse.ArgumentParser(description="Simulate nucleotide fasta")
     parser.add_argument("--length", "-l", type=int, default=100, help="Sequence length to generate; default: 100")
+    parser.add_argument("--name", "-n", type=str, default="random_seq", help="Sequence name; default: random_seq")
+    parser.add_argument("--chrom-sizes", "-c", type=str, default="", help="chrom.sizes file: contig \t length; \
+                        generate every contig instead of one sequence of --length")
+    parser.add_argument("--gc-content", "-g", type=float, default=None, help="GC content, like 0.41; default: 0.5")
+    parser.add_argument("--weights", "-w", type=str, default="", help="comma-separated weights of A,C,G,T, like 0.3,0.2,0.2,0.3; \
+                        overrides --gc-content")
+    parser.add_argument("--seed", "-s", type=int, default=None, help="Random seed; default: random")
+    parser.add_argument("--line-width", type=int, default=80, help="Number of bases per fasta line; default: 80")
+    parser.add_argument("--output", "-o", type=str, default="", help="Output fasta file; default: stdout")
     args = parser.parse_args()
 
-    fasta = generate_random_fasta(args.length)
-    print('>random_seq')
-    print(fasta)
+    weights = get_weights(args.gc_content, args.weights)
+    rng = np.random.default_rng(args.seed)
+    if args.chrom_sizes:
+        contigs = read_chrom_sizes(args.chrom_sizes)
+    else:
+        contigs = [(args.name, args.length)]
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    for name, length in contigs:
+        generate_random_fasta(out, name, length, weights, rng, args.line_width)
+    if args.output:
+        out.close()
+    else:
+        out.flush()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
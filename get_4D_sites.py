@@ -1,36 +1,260 @@
 #!/usr/bin/env python3
 #
-# This script parses degeneracy-all.sites.bed file 
+# This script parses degeneracy-all.sites.bed file
 # and outputs bed file with positions that are clear $d sites in all corresponding transripts
 
 import argparse
+from array import array
 from collections import defaultdict
+from multiprocessing import Pool
+import re
+import numpy as np
+from site_reader import iter_fields, open_input
 
 
 __author__ = "Ekaterina Osipova, 2023."
 
 
+## Standard genetic code; codons are ordered by bases T, C, A, G
+BASES = 'TCAG'
+AMINO_ACIDS = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+
+
+def make_degeneracy_table():
+    ## Returns a 64 x 3 table: for every codon and codon position,
+    ## the number of bases at this position that keep the same amino acid (4 = 4-fold)
+
+    table = np.zeros((64, 3), dtype=np.int8)
+    for codon in range(64):
+        for codon_position in range(3):
+            shift = 2 * (2 - codon_position)
+            codon_other = [(codon & ~(3 << shift)) | (b << shift) for b in range(4)]
+            table[codon, codon_position] = sum(AMINO_ACIDS[c] == AMINO_ACIDS[codon] for c in codon_other)
+    return table
+
+
+DEGENERACY_TABLE = make_degeneracy_table()
+
+## Base codes; complement of a code is code ^ 2; anything but ACGT is -1
+BASE_CODES = np.full(256, -1, dtype=np.int8)
+for code, base in enumerate(BASES):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+
+def stream_sorted_4D_sites(bed_degen, threads=1):
+    ## Reads position-sorted bed: records of the same site follow each other;
+    ## decides on every site as soon as its last record is read, keeping only the current site
+
+    site_current = None
+    all_4D = False
+    seen_chroms = set()
+    for fields in iter_fields(bed_degen, threads=threads):
+        site = (fields[0], int(fields[1]), int(fields[2]))
+
+        if site != site_current:
+            if all_4D:
+                yield (site_current[0].decode(), *site_current[1:])
+            if site_current is not None:
+                if site[0] != site_current[0]:
+                    seen_chroms.add(site_current[0])
+                if (site[0] in seen_chroms) or ((site[0] == site_current[0]) and (site[1:] < site_current[1:])):
+                    raise ValueError('bed file is not sorted by position: {}; run without --sorted'.format(b'\t'.join(fields).decode()))
+            site_current = site
+            all_4D = True
+
+        all_4D = all_4D and (fields[4] == b'4')
+
+    if all_4D:
+        yield (site_current[0].decode(), *site_current[1:])
+
+
+def compact_4D_sites(bed_degen, threads=1):
+    ## Reads bed file in any order; stores every record as integers in compact arrays:
+    ## contig id, start, length, degeneracy. Then groups records of the same site
+    ## and yields sites that are 4D in every record, in the order sites first appear
+
+    contigs = {}
+    contig_ids = array('i')
+    starts = array('q')
+    lengths = array('i')
+    degeneracies = array('b')
+    for fields in iter_fields(bed_degen, threads=threads):
+        start = int(fields[1])
+        contig_ids.append(contigs.setdefault(fields[0], len(contigs)))
+        starts.append(start)
+        lengths.append(int(fields[2]) - start)
+        degeneracies.append(4 if fields[4] == b'4' else 0)
+
+    contig_ids = np.frombuffer(contig_ids, dtype=np.int32)
+    starts = np.frombuffer(starts, dtype=np.int64)
+    lengths = np.frombuffer(lengths, dtype=np.int32)
+    is_4D = np.frombuffer(degeneracies, dtype=np.int8) == 4
+    if len(starts) == 0:
+        return
+
+    ## sort records by site; stable sort keeps the first record of every site first
+    order = np.lexsort((lengths, starts, contig_ids))
+    contig_ids, starts, lengths, is_4D = contig_ids[order], starts[order], lengths[order], is_4D[order]
+    new_site = np.concatenate(([True], (np.diff(contig_ids) != 0) | (np.diff(starts) != 0) | (np.diff(lengths) != 0)))
+    site_starts = np.flatnonzero(new_site)
+    site_all_4D = np.logical_and.reduceat(is_4D, site_starts)
+
+    ## output sites in the order of the input
+    site_starts = site_starts[site_all_4D]
+    site_starts = site_starts[np.argsort(order[site_starts], kind='stable')]
+    contig_names = [contig.decode() for contig in contigs]
+    for contig_id, start, length in zip(contig_ids[site_starts].tolist(), starts[site_starts].tolist(), lengths[site_starts].tolist()):
+        yield contig_names[contig_id], start, start + length
+
+
+def read_cds(gtf):
+    ## Reads CDS features of a gtf file (plain or gzipped; - for stdin);
+    ## returns a dict: contig -> transcript -> [strand, [(start, end, frame), ...]] (0-based, end not included)
+
+    transcript_re = re.compile(r'transcript_id "([^"]+)"')
+    cds = defaultdict(dict)
+    with open_input(gtf, 'rt') as inf:
+        for line in inf:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if (len(fields) < 9) or (fields[2] != 'CDS'):
+                continue
+            transcript = transcript_re.search(fields[8])
+            if not transcript:
+                continue
+            frame = int(fields[7]) if fields[7].isdigit() else 0
+            contig_cds = cds[fields[0]].setdefault(transcript.group(1), [fields[6], []])
+            contig_cds[1].append((int(fields[3]) - 1, int(fields[4]), frame))
+    return cds
+
+
+def index_fasta(fasta):
+    ## Scans a fasta file once; returns a dict: contig -> (first byte, last byte) of its sequence
+
+    index = {}
+    contig = None
+    start = 0
+    offset = 0
+    with open(fasta, 'rb') as inf:
+        for line in inf:
+            if line.startswith(b'>'):
+                if contig is not None:
+                    index[contig] = (start, offset)
+                contig = line[1:].split()[0].decode()
+                start = offset + len(line)
+            offset += len(line)
+    if contig is not None:
+        index[contig] = (start, offset)
+    return index
+
+
+def read_contig(fasta, start, end):
+    ## Reads sequence of one contig from its byte range in a fasta file as an array of base codes
+
+    with open(fasta, 'rb') as inf:
+        inf.seek(start)
+        sequence = inf.read(end - start)
+    sequence = sequence.replace(b'\n', b'').replace(b'\r', b'')
+    return BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def transcript_degeneracy(sequence, strand, exons):
+    ## Extracts codons of one transcript from contig sequence;
+    ## returns genomic positions of coding sites and their degeneracy
+
+    exons = sorted(exons)
+    if strand == '-':
+        positions = np.concatenate([np.arange(end - 1, start - 1, -1) for start, end, _ in exons[::-1]])
+        frame = exons[-1][2]
+    else:
+        positions = np.concatenate([np.arange(start, end) for start, end, _ in exons])
+        frame = exons[0][2]
+    positions = positions[frame:]
+    positions = positions[:len(positions) // 3 * 3]
+
+    # codons running past the end of the contig are not valid
+    in_contig = positions < len(sequence)
+    codes = np.where(in_contig, sequence[np.minimum(positions, len(sequence) - 1)], -1)
+    codes = codes.reshape(-1, 3).astype(np.int16)
+    if strand == '-':
+        codes ^= 2
+    valid = (codes >= 0).all(axis=1)
+    codons = np.where(valid, codes[:, 0] * 16 + codes[:, 1] * 4 + codes[:, 2], 0)
+    degeneracy = np.where(valid[:, None], DEGENERACY_TABLE[codons], 0)
+    return positions, degeneracy.ravel()
+
+
+def contig_4D_sites(task):
+    ## Classifies coding sites of all transcripts of one contig;
+    ## returns sorted positions of sites that are 4D in every transcript
+
+    fasta, start, end, transcripts = task
+    sequence = read_contig(fasta, start, end)
+    site_positions = []
+    site_is_4D = []
+    for strand, exons in transcripts:
+        positions, degeneracy = transcript_degeneracy(sequence, strand, exons)
+        site_positions.append(positions)
+        site_is_4D.append(degeneracy == 4)
+    if not site_positions:
+        return np.zeros(0, dtype=np.int64)
+
+    site_positions = np.concatenate(site_positions)
+    site_is_4D = np.concatenate(site_is_4D)
+    order = np.argsort(site_positions, kind='stable')
+    site_positions, site_is_4D = site_positions[order], site_is_4D[order]
+    site_starts = np.flatnonzero(np.concatenate(([True], np.diff(site_positions) != 0)))
+    site_all_4D = np.logical_and.reduceat(site_is_4D, site_starts)
+    return site_positions[site_starts[site_all_4D]]
+
+
+def fasta_gtf_4D_sites(fasta, gtf, threads):
+    ## Finds 4D sites directly from genome fasta and gtf annotation; contigs are processed in parallel
+    ## and sites are yielded in the fasta order of contigs
+
+    cds = read_cds(gtf)
+    fasta_index = index_fasta(fasta)
+    contigs = [c for c in fasta_index if c in cds]
+    tasks = [(fasta, *fasta_index[c], list(cds[c].values())) for c in contigs]
+
+    if threads > 1:
+        pool = Pool(threads)
+        contig_sites = pool.imap(contig_4D_sites, tasks)
+    else:
+        contig_sites = map(contig_4D_sites, tasks)
+
+    for contig, positions in zip(contigs, contig_sites):
+        for position in positions.tolist():
+            yield contig, position, position + 1
+    if threads > 1:
+        pool.close()
+        pool.join()
+
+
 def main():
     ## Parse argument
     parser = argparse.ArgumentParser()
-    parser.add_argument('-b', '--bed_degen', type=str, help='degeneracy bed file to parse: 4-bed format with site degeneracy in the 5th column')
+    parser.add_argument('-b', '--bed_degen', type=str, help='degeneracy bed file to parse: 4-bed format with site degeneracy in the 5th column; plain, gzip or bgzip; - for stdin')
+    parser.add_argument('-s', '--sorted', action='store_true', help='specify if bed file is sorted by position: streams it with constant memory')
+    parser.add_argument('-f', '--fasta', type=str, help='genome fasta: with --gtf, compute site degeneracy directly instead of reading degeneracy bed')
+    parser.add_argument('-g', '--gtf', type=str, help='annotation in gtf format with CDS features and transcript_id attributes')
+    parser.add_argument('-t', '--threads', type=int, default=1, help='number of processes for contigs in --fasta/--gtf mode, or threads to decompress bgzipped bed; default=1')
     args = parser.parse_args()
 
-    ## Read input bed file line by line; store sites with their degeneracy in a dict
-    sites_degen_dict = defaultdict(list)
-    with open(args.bed_degen, 'r') as inf:
-        for line in inf.readlines(): 
-            site = tuple(line.split()[:3])
-            degeneracy = line.split()[4]
-            sites_degen_dict[site].append(degeneracy)
-    
-    ## Go through the dictionary and output sites that are clear 4D in every overlapping transcript
-    for site in sites_degen_dict:
-        degeneracy = sites_degen_dict[site]
-        if (len(set(degeneracy)) == 1) and (set(degeneracy) == {'4'}):
-            print('{}'.format('\t'.join(list(site))))
+    ## Read input bed file (or compute degeneracy from fasta and gtf); group records of every site;
+    ## output sites that are clear 4D in every overlapping transcript
+    if args.fasta and args.gtf:
+        sites = fasta_gtf_4D_sites(args.fasta, args.gtf, args.threads)
+    elif args.sorted:
+        sites = stream_sorted_4D_sites(args.bed_degen, args.threads)
+    else:
+        sites = compact_4D_sites(args.bed_degen, args.threads)
+
+    for site in sites:
+        print('{}\t{}\t{}'.format(*site))
 
 
 if __name__ == "__main__":
     main()
-
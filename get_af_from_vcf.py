@@ -6,12 +6,27 @@
 
 
 import argparse
+from array import array
+from functools import partial
+import json
+from multiprocessing import Pool
+import os
+import re
+import sys
+import time
+import numpy as np
 import pysam
 
 
 __author__ = "Ekaterina Osipova, 2023."
 
 
+## Consequence classes: name=snpEff effect,effect..;name=..
+## ranked by severity: a site goes to the first class with an effect in its annotation
+DEFAULT_CLASSES = 'pN=missense_variant;pS=synonymous_variant'
+CACHE_COLUMNS = ['pos', 'ref', 'alt', 'AC', 'AN', 'AA', 'class']
+
+
 def extract_vcf_entires(vcf_data, region):
     ## Parses vcf pysam object and extracts snps from the requested region;
     ## if no region provided, goes through the entire vcf
@@ -26,22 +41,51 @@ def extract_vcf_entires(vcf_data, region):
     return vcf_entires
 
 
-def get_af_by_class(vcf_entires):
-    ## Extracts syn and nonsyn allele frequencies
+def compile_classes(classes_spec):
+    ## Parses consequence classes: name=effect,effect..;name=..
+    ## returns class names, one precompiled pattern for all effects
+    ## and a dict: effect -> index of its class (lower index = more severe)
+
+    names = []
+    effect_classes = {}
+    for class_spec in classes_spec.split(';'):
+        name, effects = class_spec.split('=')
+        for effect in effects.split(','):
+            effect_classes.setdefault(effect, len(names))
+        names.append(name)
+    pattern = re.compile('|'.join(sorted((re.escape(e) for e in effect_classes), key=len, reverse=True)))
+    return names, pattern, effect_classes
+
+
+def classify_annotation(annotation, classes):
+    ## Returns index of the most severe class with an effect in the annotation; -1 if none
+
+    _, pattern, effect_classes = classes
+    matches = pattern.findall(annotation)
+    if not matches:
+        return -1
+    return min(effect_classes[m] for m in matches)
+
 
-    AF_nonsyn = []
-    AF_syn = []    
+def get_ac_by_class(vcf_entires, classes, profile=None):
+    ## Polarizes snps with the ancestral allele;
+    ## yields (class index, derived allele count, number of ingroup alleles) of segregating sites
+    ## of the requested consequence classes.
+    ## Every INFO field is read once per record, ANN only for segregating sites;
+    ## with profile (dict), counts records and time spent on decoding and classification
+
+    clock = time.perf_counter
+    time_start = clock()
     for i in vcf_entires:
-        POS = i.pos
+        info = i.info
         REF = i.ref
-        ALT = i.alts[0]
-        AC = i.info['AC'][0]
-        AN = i.info['AN']
-        AA = i.info['AA']
-        
+        AC = info['AC'][0]
+        AN = info['AN']
+        AA = info['AA']
+
         if AA != REF:
             # check if snp wasn't introduced with the outgroup
-            if (AA == ALT) and (AC != 2):
+            if (AA == i.alts[0]) and (AC != 2):
                 # flip AC
                 AC = AN - AC
             # exlude if it is new or 3-way to resolve
@@ -49,14 +93,349 @@ def get_af_by_class(vcf_entires):
                 AC = 0
         # remove outgroup from AN
         AN = AN - 2
-        AF = AC / AN
 
-        if (AF != 0) and (AF != 1):
-            if 'missense_variant' in i.info['ANN'][0]:
-                AF_nonsyn.append(AF)
-            elif 'synonymous_variant' in i.info['ANN'][0]:
-                AF_syn.append(AF)
-    return AF_nonsyn, AF_syn
+        site_class = -1
+        if (AC != 0) and (AC != AN):
+            annotation = info['ANN'][0]
+            if profile is not None:
+                time_decoded = clock()
+                profile['decode'] += time_decoded - time_start
+            site_class = classify_annotation(annotation, classes)
+            if profile is not None:
+                profile['classification'] += clock() - time_decoded
+        elif profile is not None:
+            profile['decode'] += clock() - time_start
+        if profile is not None:
+            profile['records'] += 1
+
+        if site_class >= 0:
+            yield site_class, AC, AN
+        time_start = clock()
+
+
+def get_af_by_class(vcf_entires, classes, profile=None):
+    ## Extracts allele frequencies of every class (nonsyn: pN and syn: pS by default)
+
+    AF = [[] for _ in classes[0]]
+    for site_class, AC, AN in get_ac_by_class(vcf_entires, classes, profile):
+        AF[site_class].append(AC / AN)
+    return dict(zip(classes[0], AF))
+
+
+def get_sfs_by_class(vcf_entires, folded, classes, profile=None):
+    ## Builds site frequency spectra of every class while streaming:
+    ## number of sites per derived allele count (per minor allele count if folded).
+    ## Spectra grow up to the largest number of ingroup alleles n; memory is O(n)
+
+    SFS = [[] for _ in classes[0]]
+    n = 0
+    for site_class, AC, AN in get_ac_by_class(vcf_entires, classes, profile):
+        if AC > AN:
+            # derived allele counted in the outgroup only
+            continue
+        if folded:
+            AC = min(AC, AN - AC)
+        n = max(n, AN)
+        sfs = SFS[site_class]
+        if len(sfs) <= AC:
+            sfs.extend([0] * (AC + 1 - len(sfs)))
+        sfs[AC] += 1
+
+    ## pad spectra to n + 1 bins (n // 2 + 1 if folded)
+    n_bins = n // 2 + 1 if folded else n + 1
+    for sfs in SFS:
+        sfs.extend([0] * (n_bins - len(sfs)))
+    return dict(zip(classes[0], SFS)), n
+
+
+def get_cache_key(vcf):
+    ## Identifies a VCF file version: path, size and modification time
+
+    stat = os.stat(vcf)
+    return {'vcf': os.path.abspath(vcf), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_site_cache(vcf, cache_dir, classes_spec):
+    ## Decodes every VCF record once and writes per-contig columns to cache_dir:
+    ## <contig number>.<column>.npy for pos, ref, alt, AC, AN, AA and consequence class code
+    ## (class index + 1, 0 for other sites), and meta.json with the VCF key, classes and the list of contigs
+
+    os.makedirs(cache_dir, exist_ok=True)
+    classes = compile_classes(classes_spec)
+    contigs = []
+
+    def write_contig():
+        n = len(contigs) - 1
+        columns['pos'] = np.frombuffer(columns['pos'], dtype=np.int64)
+        columns['AC'] = np.frombuffer(columns['AC'], dtype=np.int32)
+        columns['AN'] = np.frombuffer(columns['AN'], dtype=np.int32)
+        columns['class'] = np.frombuffer(columns['class'], dtype=np.int8)
+        for allele_column in ['ref', 'alt', 'AA']:
+            columns[allele_column] = np.array(columns[allele_column], dtype=bytes)
+        for column in CACHE_COLUMNS:
+            np.save(os.path.join(cache_dir, '{}.{}.npy'.format(n, column)), columns[column])
+
+    columns = None
+    with pysam.VariantFile(vcf) as vcf_data:
+        for i in vcf_data:
+            if (not contigs) or (i.chrom != contigs[-1]):
+                if contigs:
+                    write_contig()
+                contigs.append(i.chrom)
+                columns = {
+                           'pos': array('q'), 'ref': [], 'alt': [], 'AC': array('i'),
+                           'AN': array('i'), 'AA': [], 'class': array('b')
+                           }
+            info = i.info
+            columns['pos'].append(i.pos)
+            columns['ref'].append(i.ref.encode())
+            columns['alt'].append(i.alts[0].encode() if i.alts else b'')
+            columns['AC'].append(info['AC'][0] if 'AC' in info else 0)
+            columns['AN'].append(info['AN'] if 'AN' in info else 0)
+            columns['AA'].append(info['AA'].encode() if 'AA' in info else b'')
+            columns['class'].append(classify_annotation(info['ANN'][0], classes) + 1 if 'ANN' in info else 0)
+    if contigs:
+        write_contig()
+
+    meta = get_cache_key(vcf)
+    meta['classes'] = classes_spec
+    meta['contigs'] = contigs
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as outf:
+        json.dump(meta, outf)
+
+
+def load_site_cache(vcf, cache_dir, classes_spec=DEFAULT_CLASSES):
+    ## Memory-maps the site cache of the VCF; (re)builds it first if it is missing
+    ## or was made from another version of the VCF or with other classes.
+    ## Returns a dict: contig -> dict of columns
+
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    meta = {}
+    if os.path.exists(meta_file):
+        with open(meta_file) as inf:
+            meta = json.load(inf)
+    cache_key = get_cache_key(vcf)
+    cache_key['classes'] = classes_spec
+    if {k: meta.get(k) for k in cache_key} != cache_key:
+        build_site_cache(vcf, cache_dir, classes_spec)
+        with open(meta_file) as inf:
+            meta = json.load(inf)
+
+    site_cache = {}
+    for n, contig in enumerate(meta['contigs']):
+        site_cache[contig] = {
+                              column: np.load(os.path.join(cache_dir, '{}.{}.npy'.format(n, column)), mmap_mode='r')
+                              for column in CACHE_COLUMNS
+                              }
+    return site_cache
+
+
+def extract_cache_sites(site_cache, contig, start=None, end=None):
+    ## Slices cached columns of sites overlapping region start-end (0-based, like pysam fetch);
+    ## the whole contig if no region is given
+
+    sites = site_cache.get(contig)
+    if sites is None:
+        return {column: np.zeros(0) for column in CACHE_COLUMNS}
+    if start is None:
+        return sites
+
+    pos = sites['pos']
+    max_ref_length = max(sites['ref'].dtype.itemsize, 1)
+    lo = np.searchsorted(pos, start + 2 - max_ref_length, side='left')
+    hi = np.searchsorted(pos, end, side='right')
+    region_sites = {column: sites[column][lo:hi] for column in CACHE_COLUMNS}
+    if max_ref_length > 1:
+        # long REF alleles starting before the region may still overlap it
+        overlap = region_sites['pos'] - 1 + np.char.str_len(region_sites['ref']) > start
+        region_sites = {column: values[overlap] for column, values in region_sites.items()}
+    return region_sites
+
+
+def extract_cache_entires(site_cache, region):
+    ## Same as extract_vcf_entires for the site cache: region chr|start|end
+    ## or all contigs if no region provided
+
+    if region == '':
+        contigs = [extract_cache_sites(site_cache, contig) for contig in site_cache]
+        if not contigs:
+            return {column: np.zeros(0) for column in CACHE_COLUMNS}
+        return {column: np.concatenate([sites[column] for sites in contigs]) for column in CACHE_COLUMNS}
+    contig = region.split('|')[0]
+    start = int(region.split('|')[1])
+    end = int(region.split('|')[2])
+    return extract_cache_sites(site_cache, contig, start, end)
+
+
+def polarize_sites(sites):
+    ## Polarizes columns of sites (ref, alt, AC, AN, AA) with the ancestral allele, as in get_ac_by_class:
+    ## returns derived allele counts (0 for excluded sites) and numbers of ingroup alleles
+
+    AC = np.asarray(sites['AC'], dtype=np.int64)
+    AN = np.asarray(sites['AN'], dtype=np.int64)
+    is_ref = sites['AA'] == sites['ref']
+    is_alt = sites['AA'] == sites['alt']
+    # flip AC if the ancestral allele is ALT and the snp wasn't introduced with the outgroup;
+    # exclude if it is new or 3-way to resolve
+    AC = np.where(is_ref, AC, np.where(is_alt & (AC != 2), AN - AC, 0))
+    # remove outgroup from AN
+    AN = AN - 2
+    return AC, AN
+
+
+def get_ac_by_class_cached(sites):
+    ## Same as get_ac_by_class over cached columns, as array operations:
+    ## returns class indices, derived allele counts and numbers of ingroup alleles of segregating sites
+
+    AC, AN = polarize_sites(sites)
+    keep = (AC != 0) & (AC != AN) & (sites['class'] != 0)
+    return np.asarray(sites['class'], dtype=np.int64)[keep] - 1, AC[keep], AN[keep]
+
+
+def get_af_by_class_cached(sites, classes, profile=None):
+    ## Extracts allele frequencies of every class from cached columns
+
+    time_start = time.perf_counter()
+    site_class, AC, AN = get_ac_by_class_cached(sites)
+    AF = AC / AN
+    AF = {name: AF[site_class == c].tolist() for c, name in enumerate(classes[0])}
+    if profile is not None:
+        profile['records'] += len(sites['pos'])
+        profile['decode'] += time.perf_counter() - time_start
+    return AF
+
+
+def get_sfs_by_class_cached(sites, folded, classes, profile=None):
+    ## Builds site frequency spectra of every class from cached columns
+
+    time_start = time.perf_counter()
+    site_class, AC, AN = get_ac_by_class_cached(sites)
+    # derived allele counted in the outgroup only
+    keep = AC <= AN
+    site_class, AC, AN = site_class[keep], AC[keep], AN[keep]
+    if folded:
+        AC = np.minimum(AC, AN - AC)
+    n = int(AN.max()) if len(AN) else 0
+    n_bins = n // 2 + 1 if folded else n + 1
+    SFS = {name: np.bincount(AC[site_class == c], minlength=n_bins).tolist() for c, name in enumerate(classes[0])}
+    if profile is not None:
+        profile['records'] += len(sites['pos'])
+        profile['decode'] += time.perf_counter() - time_start
+    return SFS, n
+
+
+def format_af_line(AF):
+    ## Formats allele frequencies of every class: __pN__:AF,AF..\t__pS__:AF,AF..
+
+    return '\t'.join(
+                      '__{}__:{}'.format(name, ','.join([str(round(i, 3)) for i in AF_class]))
+                      for name, AF_class in AF.items()
+                      )
+
+
+def format_sfs(SFS, n, folded, sfs_format, region=''):
+    ## Formats SFS of every class as a line: __pN__:count,count..\t__pS__:count,count..
+    ## or as a json object with the region, number of ingroup alleles and all spectra
+
+    if sfs_format == 'json':
+        return json.dumps({'region': region, 'n': n, 'folded': folded, **SFS})
+    return '\t'.join(
+                      '__{}__:{}'.format(name, ','.join([str(i) for i in SFS_class]))
+                      for name, SFS_class in SFS.items()
+                      )
+
+
+def new_profile():
+    ## Counters of the --profile report
+
+    return {'records': 0, 'decode': 0.0, 'classification': 0.0, 'output': 0.0}
+
+
+def report_profile(profile, wall_time):
+    ## Writes records/s and time split between decode, classification and output to stderr
+
+    sys.stderr.write(
+                     'records: {}\trecords/s: {:.0f}\twall time: {:.3f} s\n'
+                     'decode: {:.3f} s\tclassification: {:.3f} s\toutput: {:.3f} s\n'.format(
+                     profile['records'], profile['records'] / wall_time if wall_time else 0, wall_time,
+                     profile['decode'], profile['classification'], profile['output'])
+                     )
+
+
+def read_regions_bed(regions_bed):
+    ## Reads bed file with regions: chr \t start \t end
+
+    regions = []
+    with open(regions_bed) as inf:
+        for line in inf:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            contig, start, end = line.split()[:3]
+            regions.append((contig, int(start), int(end)))
+    return regions
+
+
+## VCF handle (or site cache) of a worker process: opened once, reused for every region
+worker_vcf_data = None
+worker_site_cache = None
+
+
+def init_worker(vcf, cache_dir='', classes_spec=DEFAULT_CLASSES):
+    ## Opens the indexed VCF (or memory-maps its site cache) once per worker process
+
+    global worker_vcf_data, worker_site_cache
+    if cache_dir:
+        worker_site_cache = load_site_cache(vcf, cache_dir, classes_spec)
+    else:
+        worker_vcf_data = pysam.VariantFile(vcf)
+
+
+def get_af_in_region(region, sfs='', sfs_format='tsv', classes_spec=DEFAULT_CLASSES, profile=False):
+    ## Extracts allele frequencies (or SFS) by class in one region with the worker VCF handle;
+    ## returns the output line and profile counters (None if not profiling)
+
+    contig, start, end = region
+    classes = compile_classes(classes_spec)
+    profile = new_profile() if profile else None
+    if worker_site_cache is not None:
+        sites = extract_cache_sites(worker_site_cache, contig, start, end)
+        get_af, get_sfs = get_af_by_class_cached, get_sfs_by_class_cached
+    else:
+        # a contig missing from the VCF has no sites, as in the site cache
+        sites = worker_vcf_data.fetch(contig, start, end) if contig in worker_vcf_data.header.contigs else []
+        get_af, get_sfs = get_af_by_class, get_sfs_by_class
+
+    if sfs:
+        folded = sfs == 'folded'
+        SFS, n = get_sfs(sites, folded, classes, profile)
+        time_start = time.perf_counter()
+        if sfs_format == 'json':
+            line = format_sfs(SFS, n, folded, sfs_format, '{}|{}|{}'.format(contig, start, end))
+        else:
+            line = '{}\t{}\t{}\t{}'.format(contig, start, end, format_sfs(SFS, n, folded, sfs_format))
+    else:
+        AF = get_af(sites, classes, profile)
+        time_start = time.perf_counter()
+        line = '{}\t{}\t{}\t{}'.format(contig, start, end, format_af_line(AF))
+    if profile is not None:
+        profile['output'] += time.perf_counter() - time_start
+    return line, profile
+
+
+def get_af_in_regions(vcf, regions, threads, sfs='', sfs_format='tsv', cache_dir='', classes_spec=DEFAULT_CLASSES, profile=False):
+    ## Yields (output line, profile counters) per region, in the order of regions;
+    ## regions are split between worker processes, each with its own VCF handle
+
+    get_output = partial(get_af_in_region, sfs=sfs, sfs_format=sfs_format, classes_spec=classes_spec, profile=profile)
+    if cache_dir:
+        # build the cache once, before workers map it
+        load_site_cache(vcf, cache_dir, classes_spec)
+    if threads > 1:
+        with Pool(threads, initializer=init_worker, initargs=(vcf, cache_dir, classes_spec)) as pool:
+            yield from pool.imap(get_output, regions, chunksize=16)
+    else:
+        init_worker(vcf, cache_dir, classes_spec)
+        yield from map(get_output, regions)
 
 
 def main():
@@ -75,20 +454,108 @@ def main():
                         default='', 
                         help='bed line with a region to extract from VCF: chr_start_end'
                         )
+    parser.add_argument(
+                        '-b',
+                        '--regions-bed',
+                        type=str,
+                        default='',
+                        help='bed file with regions to extract from VCF: outputs one line per region \
+                        chr \t start \t end \t __pN__:.. \t __pS__:..'
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--threads',
+                        type=int,
+                        default=1,
+                        help='number of processes for --regions-bed; default: 1'
+                        )
+    parser.add_argument(
+                        '-s',
+                        '--sfs',
+                        type=str,
+                        choices=['unfolded', 'folded'],
+                        default='',
+                        help='output syn and nonsyn site frequency spectra instead of allele frequencies'
+                        )
+    parser.add_argument(
+                        '-f',
+                        '--sfs-format',
+                        type=str,
+                        choices=['tsv', 'json'],
+                        default='tsv',
+                        help='SFS output: tsv line __pN__:counts\t__pS__:counts or json object per region; default: tsv'
+                        )
+    parser.add_argument(
+                        '-c',
+                        '--cache',
+                        type=str,
+                        default='',
+                        help='directory with a columnar site cache of the VCF: built on first use \
+                        (or when the VCF changed), then queries read cached arrays instead of the VCF'
+                        )
+    parser.add_argument(
+                        '-C',
+                        '--classes',
+                        type=str,
+                        default=DEFAULT_CLASSES,
+                        help='consequence classes ranked by severity: name=effect,effect..;name=..; \
+                        default: pN=missense_variant;pS=synonymous_variant'
+                        )
+    parser.add_argument(
+                        '-P',
+                        '--profile',
+                        action='store_true',
+                        help='report records/s and time spent on decode, classification and output to stderr'
+                        )
 
     args = parser.parse_args()
-    
-    vcf_data = pysam.VariantFile(args.vcf)
+
+    ## Batch mode: many regions from one indexed VCF
+    time_start = time.perf_counter()
+    profile = new_profile() if args.profile else None
+    if args.regions_bed:
+        regions = read_regions_bed(args.regions_bed)
+        for line, region_profile in get_af_in_regions(
+                                                      args.vcf, regions, args.threads, args.sfs, args.sfs_format,
+                                                      args.cache, args.classes, args.profile
+                                                      ):
+            time_output = time.perf_counter()
+            print(line)
+            if profile is not None:
+                for counter in profile:
+                    profile[counter] += region_profile[counter]
+                profile['output'] += time.perf_counter() - time_output
+        if profile is not None:
+            report_profile(profile, time.perf_counter() - time_start)
+        return
+
     region = args.region
+    classes = compile_classes(args.classes)
+
+    ## Read input VCF (or its site cache) and extract AF by class
+    if args.cache:
+        site_cache = load_site_cache(args.vcf, args.cache, args.classes)
+        vcf_entires = extract_cache_entires(site_cache, region)
+        get_af, get_sfs = get_af_by_class_cached, get_sfs_by_class_cached
+    else:
+        vcf_data = pysam.VariantFile(args.vcf)
+        vcf_entires = extract_vcf_entires(vcf_data, region)
+        get_af, get_sfs = get_af_by_class, get_sfs_by_class
+    if args.sfs:
+        folded = args.sfs == 'folded'
+        SFS, n = get_sfs(vcf_entires, folded, classes, profile)
+        time_output = time.perf_counter()
+        print(format_sfs(SFS, n, folded, args.sfs_format, region))
+    else:
+        AF = get_af(vcf_entires, classes, profile)
 
-    ## Read input VCF and extract AF by class
-    vcf_entires = extract_vcf_entires(vcf_data, region)
-    AF_nonsyn, AF_syn = get_af_by_class(vcf_entires)
+        ## Output AF
+        time_output = time.perf_counter()
+        print(format_af_line(AF))
 
-    ## Output AF
-    AF_nonsyn_line = ','.join([str(round(i, 3)) for i in AF_nonsyn])
-    AF_syn_line = ','.join([str(round(i, 3)) for i in AF_syn])
-    print('__pN__:{}\t__pS__:{}'.format(AF_nonsyn_line, AF_syn_line))
+    if profile is not None:
+        profile['output'] += time.perf_counter() - time_output
+        report_profile(profile, time.perf_counter() - time_start)
 
 
 if __name__ == '__main__':
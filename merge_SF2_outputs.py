@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# This script merges chunked SweepFinder2 outputs of every chromosome (with and without recombination map)
+# into per-chromosome and genome-wide CLR tables: sorted chunk outputs are streamed through a k-way merge,
+# grid points repeated at chunk boundaries are written once
+
+
+import argparse
+from array import array
+import glob
+import heapq
+import os
+import numpy as np
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+## Record of the binary table: chromosome number (row of contigs.tsv, from 0), grid location, CLR and alpha
+BINARY_DTYPE = np.dtype([('chrom', np.uint16), ('location', np.float64), ('LR', np.float32), ('alpha', np.float32)])
+
+## SF2 output file patterns of a chromosome: with recombination map and without
+VARIANTS = {
+            'recmap': ('{0}/header.{0}.SF2.*.out', '{0}/{0}.SF2.out'),
+            'norecmap': ('{0}/norecmap.header.{0}.SF2.*.out', '{0}/norecmap.{0}.SF2.out')
+            }
+
+
+def read_chrom_sizes(chrom_sizes, min_length):
+    ## Reads chrom.sizes file: contig \t length; returns contigs longer than min_length
+
+    contigs = []
+    with open(chrom_sizes) as inf:
+        for line in inf:
+            if line.startswith('#') or not line.strip():
+                continue
+            chrom, length = line.split()[:2]
+            if int(length) > min_length:
+                contigs.append(chrom)
+    return contigs
+
+
+def read_sf2_output(sf2_output):
+    ## Reads SF2 output: location \t LR \t alpha; yields (location, line)
+
+    with open(sf2_output) as inf:
+        for line in inf:
+            if not line[0].isdigit():
+                # header
+                continue
+            yield float(line.split('\t', 1)[0]), line
+
+
+def merge_chunks(chunk_outputs):
+    ## Merges sorted chunk outputs of one chromosome by location;
+    ## a grid point present in two overlapping chunks is yielded once
+
+    location_previous = None
+    for location, line in heapq.merge(*[read_sf2_output(f) for f in chunk_outputs], key=lambda r: r[0]):
+        if location == location_previous:
+            continue
+        location_previous = location
+        yield location, line
+
+
+def write_binary_block(records, outf):
+    ## Writes a block of (chrom number, location, LR, alpha) records as BINARY_DTYPE
+
+    block = np.empty(len(records[0]), dtype=BINARY_DTYPE)
+    for field, values in zip(BINARY_DTYPE.names, records):
+        block[field] = np.frombuffer(values, dtype=values.typecode)
+    block.tofile(outf)
+
+
+def merge_variant(contigs, variant, prefix, binary, block_size=1_000_000):
+    ## Merges chunks of every chromosome: writes per-chromosome SF2 output,
+    ## genome-wide table <prefix>.<variant>.tsv: chrom \t location \t LR \t alpha
+    ## and with binary <prefix>.<variant>.bin (BINARY_DTYPE) with <prefix>.<variant>.contigs.tsv: chrom, number of points, offset
+
+    chunk_pattern, merged_pattern = VARIANTS[variant]
+    genome_out = open('{}.{}.tsv'.format(prefix, variant), 'w', buffering=1024 * 1024)
+    genome_out.write('chrom\tlocation\tLR\talpha\n')
+    if binary:
+        binary_out = open('{}.{}.bin'.format(prefix, variant), 'wb')
+        binary_contigs = []
+
+    n_points = 0
+    for chrom in contigs:
+        chunk_outputs = sorted(glob.glob(chunk_pattern.format(chrom)))
+        if not chunk_outputs:
+            continue
+        # only contigs with outputs get a row of contigs.tsv
+        chrom_number = len(binary_contigs) if binary else None
+
+        records = (array('H'), array('d'), array('f'), array('f'))
+        chrom_start = n_points
+        with open(merged_pattern.format(chrom), 'w', buffering=1024 * 1024) as chrom_out:
+            chrom_out.write('location\tLR\talpha\n')
+            for location, line in merge_chunks(chunk_outputs):
+                chrom_out.write(line)
+                genome_out.write(chrom + '\t' + line)
+                n_points += 1
+                if binary:
+                    LR, alpha = line.split()[1:3]
+                    records[0].append(chrom_number)
+                    records[1].append(location)
+                    records[2].append(float(LR))
+                    records[3].append(float(alpha))
+                    if len(records[0]) == block_size:
+                        write_binary_block(records, binary_out)
+                        records = (array('H'), array('d'), array('f'), array('f'))
+        if binary:
+            if records[0]:
+                write_binary_block(records, binary_out)
+            binary_contigs.append((chrom, n_points - chrom_start, chrom_start))
+
+    genome_out.close()
+    if binary:
+        binary_out.close()
+        with open('{}.{}.contigs.tsv'.format(prefix, variant), 'w') as outf:
+            for chrom, n_chrom_points, offset in binary_contigs:
+                outf.write('{}\t{}\t{}\n'.format(chrom, n_chrom_points, offset))
+
+
+def main():
+    ## Parse argument
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                        '-c',
+                        '--chroms',
+                        type=str,
+                        help='chrom.sizes file: chrom \t length; chunk outputs are <chrom>/[norecmap.]header.<chrom>.SF2.<N>.out'
+                        )
+    parser.add_argument(
+                        '-m',
+                        '--min_length',
+                        type=int,
+                        default=1_000_000,
+                        help='only chromosomes longer than this are used; default=1_000_000'
+                        )
+    parser.add_argument(
+                        '-v',
+                        '--variants',
+                        type=str,
+                        default='recmap,norecmap',
+                        help='comma-separated SF2 runs to merge: recmap (-lrg), norecmap (-lg); default=recmap,norecmap'
+                        )
+    parser.add_argument(
+                        '-o',
+                        '--prefix',
+                        type=str,
+                        default='SF2',
+                        help='prefix of genome-wide tables: <prefix>.<variant>.tsv; default=SF2'
+                        )
+    parser.add_argument(
+                        '-b',
+                        '--binary',
+                        action='store_true',
+                        help='specify if you want a compact binary table too: <prefix>.<variant>.bin with <prefix>.<variant>.contigs.tsv'
+                        )
+    args = parser.parse_args()
+
+    contigs = read_chrom_sizes(args.chroms, args.min_length)
+    if os.path.dirname(args.prefix):
+        os.makedirs(os.path.dirname(args.prefix), exist_ok=True)
+    for variant in args.variants.split(','):
+        if variant not in VARIANTS:
+            raise ValueError('unknown SF2 run: {}; use recmap or norecmap'.format(variant))
+        merge_variant(contigs, variant, args.prefix, args.binary)
+
+
+if __name__ == "__main__":
+    main()
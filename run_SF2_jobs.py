@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# This script runs SweepFinder2 jobs planned by write_split_SF2_jobs.py locally
+# on a bounded number of processes: jobs start when their dependencies are done,
+# finished chunks are skipped, wall time and peak memory of every job are recorded
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+def read_jobs(jobs_table):
+    ## Reads jobs table of write_split_SF2_jobs.py: job, depends_on, script, input, output;
+    ## returns a dict job -> (list of dependencies, script, input, output) in the table order
+
+    jobs = {}
+    with open(jobs_table) as inf:
+        for line in inf:
+            job, depends, script, input_file, output = line.rstrip('\n').split('\t')[:5]
+            if job == 'job':
+                # header
+                continue
+            depends = depends.split(',') if depends != '.' else []
+            jobs[job] = (depends, script, input_file, output if output != '.' else '')
+    return jobs
+
+
+def read_runs(run_manifest):
+    ## Reads run manifest of previous runs; returns a dict job -> status of its last run
+
+    runs = {}
+    if os.path.exists(run_manifest):
+        with open(run_manifest) as inf:
+            for line in inf:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] != 'job':
+                    runs[fields[0]] = fields[1]
+    return runs
+
+
+def last_field(file_name, skip_header=True):
+    ## Returns the first field of the last line of a file (reads only its end); None if there are no lines
+
+    with open(file_name, 'rb') as inf:
+        inf.seek(0, os.SEEK_END)
+        size = inf.tell()
+        inf.seek(max(0, size - 64 * 1024))
+        lines = inf.read().splitlines()
+    lines = [l for l in lines if l.strip()]
+    if not lines or (skip_header and not lines[-1][:1].isdigit()):
+        return None
+    return lines[-1].split()[0].decode()
+
+
+def is_done(job, jobs, runs):
+    ## Job is done if its output covers the last position of its input chunk (last grid position);
+    ## jobs without output (recombination map) are done if their last run succeeded
+    ## or was skipped by a resumed run as done before
+
+    _, _, input_file, output = jobs[job]
+    if not output:
+        return runs.get(job) in ('done', 'skipped')
+    if not (os.path.exists(output) and os.path.exists(input_file)):
+        return False
+    last_position = last_field(input_file)
+    last_location = last_field(output)
+    if (last_position is None) or (last_location is None):
+        return False
+    return round(float(last_location)) >= int(last_position)
+
+
+def run_jobs(jobs, threads, run_manifest, resume):
+    ## Runs jobs with at most threads at a time; every finished job is appended to the run manifest:
+    ## job, status (done, failed, skipped, dependency_failed), exit code, wall time in s, peak memory in KB
+
+    runs = read_runs(run_manifest)
+    new_manifest = not os.path.exists(run_manifest)
+    outf = open(run_manifest, 'a', buffering=1)
+    if new_manifest:
+        outf.write('job\tstatus\texit_code\twall_time\tmax_rss_kb\n')
+
+    done = set()
+    failed = set()
+    pending = []
+    for job in jobs:
+        if resume and is_done(job, jobs, runs):
+            done.add(job)
+            outf.write('{}\tskipped\t.\t.\t.\n'.format(job))
+        else:
+            pending.append(job)
+
+    running = {}
+    while pending or running:
+        ## start every job whose dependencies are done, while there are free processes
+        for job in list(pending):
+            depends = jobs[job][0]
+            if any((d in failed) or (d not in jobs) for d in depends):
+                pending.remove(job)
+                failed.add(job)
+                outf.write('{}\tdependency_failed\t.\t.\t.\n'.format(job))
+            elif (len(running) < threads) and all(d in done for d in depends):
+                pending.remove(job)
+                script = jobs[job][1]
+                with open(script + '.log', 'w') as log:
+                    process = subprocess.Popen(['bash', script], stdout=log, stderr=subprocess.STDOUT)
+                running[process.pid] = (job, process, time.perf_counter())
+
+        if not running:
+            ## nothing runs and nothing can start: dependencies make a cycle
+            for job in pending:
+                failed.add(job)
+                outf.write('{}\tdependency_failed\t.\t.\t.\n'.format(job))
+            pending = []
+            continue
+
+        ## wait for any job; its resource usage includes everything the job script started
+        pid, status, rusage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        job, process, time_start = running.pop(pid)
+        exit_code = os.waitstatus_to_exitcode(status)
+        process.returncode = exit_code
+        if exit_code == 0:
+            done.add(job)
+            job_status = 'done'
+        else:
+            failed.add(job)
+            job_status = 'failed'
+        outf.write('{}\t{}\t{}\t{:.3f}\t{}\n'.format(job, job_status, exit_code, time.perf_counter() - time_start, rusage.ru_maxrss))
+
+    outf.close()
+    return failed
+
+
+def main():
+    ## Parse argument
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                        '-j',
+                        '--jobs',
+                        type=str,
+                        default='SF2_jobs.tsv',
+                        help='jobs table written by write_split_SF2_jobs.py; default=SF2_jobs.tsv'
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--threads',
+                        type=int,
+                        default=1,
+                        help='number of jobs to run at the same time; default=1'
+                        )
+    parser.add_argument(
+                        '-o',
+                        '--run_manifest',
+                        type=str,
+                        default='SF2_runs.tsv',
+                        help='run manifest to append job status, wall time and peak memory to; default=SF2_runs.tsv'
+                        )
+    parser.add_argument(
+                        '-f',
+                        '--force',
+                        action='store_true',
+                        help='specify if you want to run all jobs again: by default finished jobs are skipped'
+                        )
+    args = parser.parse_args()
+
+    failed = run_jobs(read_jobs(args.jobs), args.threads, args.run_manifest, not args.force)
+    if failed:
+        sys.stderr.write('{} jobs failed: {}\n'.format(len(failed), ', '.join(sorted(failed))))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
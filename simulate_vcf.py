@@ -2,23 +2,48 @@
 #
 # This script generates a polarized VCF of N diploid individuals 
 import argparse
+from itertools import chain
+from multiprocessing import Pool
 import msprime
+import os
+import shutil
 import sys
+import tempfile
 import numpy as np
+import pysam
 import random
 
 
 __author__ = "Ekaterina Osipova, 2024."
 
 
+def get_sampling(args):
+    ## Returns msprime.simulate sampling arguments and demographic events:
+    ## ingroup haplotypes only, or with --outgroup 2 more haplotypes of an outgroup population
+    ## that split from the ingroup --outgroup-divergence generations ago
+
+    if not args.outgroup:
+        return {'sample_size': 2 * args.num_individuals}, []
+
+    population_configurations = [
+        msprime.PopulationConfiguration(sample_size=2 * args.num_individuals, initial_size=args.population_size),
+        msprime.PopulationConfiguration(sample_size=2, initial_size=args.population_size)
+    ]
+    split = msprime.MassMigration(time=args.outgroup_divergence, source=1, destination=0, proportion=1.0)
+    return {'population_configurations': population_configurations}, [split]
+
+
 def simulate_vcf(args):
     # Simulate the population
+    sampling, demographic_events = get_sampling(args)
     tree_sequence = msprime.simulate(
-        sample_size=2 * args.num_individuals,
+        **sampling,
         Ne=args.population_size,
         length=args.chromosome_length,
         mutation_rate=args.mutation_rate,
-        recombination_rate=args.recombination_rate
+        recombination_rate=args.recombination_rate,
+        demographic_events=demographic_events,
+        random_seed=args.random_seed
     )
     return(tree_sequence)
 
@@ -36,73 +61,89 @@ def simulate_bottleneck_vcf(args):
             time=args.bottleneck_start, initial_size=args.bottleneck_size)
     ]
 
+    # Add the outgroup split if requested; events go in time order
+    sampling, outgroup_events = get_sampling(args)
+    demographic_events = sorted(demographic_events + outgroup_events, key=lambda event: event.time)
+
     # Simulate the tree sequence with the bottleneck
     tree_sequence = msprime.simulate(
-        sample_size=2 * args.num_individuals, 
+        **sampling,
         Ne=args.population_size,
         length=args.chromosome_length,
         mutation_rate=args.mutation_rate,
         recombination_rate=args.recombination_rate,
-        demographic_events=demographic_events
+        demographic_events=demographic_events,
+        random_seed=args.random_seed
     )
     return(tree_sequence)
 
 
 
-# def simulate_bottleneck_and_outgroup(args):
-#     # Define the demographic events to simulate a bottleneck
-#     demographic_events = [
-#         msprime.PopulationParametersChange(
-#             time=args.bottleneck_end, initial_size=args.population_size),
-#         msprime.PopulationParametersChange(
-#             time=args.bottleneck_start, initial_size=args.bottleneck_size)
-#     ]
-
-#     # An additional sample for the outgroup
-#     num_individuals_with_outgroup = 2 * args.num_individuals + 2  # 20 individuals + 1 outgroup individual
-
-#     # Simulate the tree sequence with the bottleneck and one outgroup individual
-#     tree_sequence = msprime.simulate(
-#         sample_size=num_individuals_with_outgroup,  # 42 haplotypes: 40 from main population, 2 from outgroup
-#         Ne=args.population_size,
-#         length=args.chromosome_length,
-#         mutation_rate=args.mutation_rate,
-#         recombination_rate=args.recombination_rate,
-#         demographic_events=demographic_events
-#     )
-
-#     # Assume the outgroup is the last two haplotypes
-#     outgroup_nodes = [num_individuals_with_outgroup - 2, num_individuals_with_outgroup - 1]
-
-#     # Polarize the VCF based on the outgroup
-#     tree_sequence.write_vcf(sys.stdout,
-#                             ploidy=2, 
-#                             ancestral_alleles={
-#                                 variant.site.id: variant.alleles[
-#                                     variant.genotypes[outgroup_nodes[0]]
-#                                 ]
-#                                 for variant in tree_sequence.variants()
-#                             },
-#                             individual_mapping=range(2 * args.num_individuals)  # Map only the intended individuals, exclude outgroup
-#     )
+def format_genotype_block(prefixes, genotypes):
+    ## Formats a block of VCF lines: prefixes hold the fixed fields of every site (ending with GT\t),
+    ## genotypes is a (sites x haplotypes) matrix; pairs of haplotypes become a|b columns
+    ## written as bytes at once for the whole block
 
+    n_sites, n_haplotypes = genotypes.shape
+    if (n_haplotypes == 0) or (genotypes.min() < 0) or (genotypes.max() > 9):
+        # rare cases: no samples, missing data or multi-digit alleles
+        return b''.join(
+                        prefix + '\t'.join(f"{g[2 * i]}|{g[2 * i + 1]}" for i in range(n_haplotypes // 2)).encode() + b'\n'
+                        for prefix, g in zip(prefixes, genotypes)
+                        )
 
-def write_vcf(tree_sequence, args):
-    # Write the VCF with or without ATGC genotypes in REF and ALT fileds
+    cells = np.empty((n_sites, n_haplotypes // 2, 4), dtype=np.uint8)
+    cells[:, :, 0] = genotypes[:, 0::2] + ord('0')
+    cells[:, :, 1] = ord('|')
+    cells[:, :, 2] = genotypes[:, 1::2] + ord('0')
+    cells[:, :, 3] = ord('\t')
+    cells[:, -1, 3] = ord('\n')
+    rows = memoryview(cells.tobytes())
+    row_length = cells.shape[1] * 4
+    return b''.join(chain.from_iterable(
+                                        (prefix, rows[i * row_length:(i + 1) * row_length])
+                                        for i, prefix in enumerate(prefixes)
+                                        ))
+
+
+def get_site_prefixes(sites, genotypes, outgroup_genotypes, args):
+    ## Formats fixed VCF fields of a block of sites (ending with GT\t); with --outgroup,
+    ## INFO has the ancestral allele of the outgroup (AA) and AC, AN that count the outgroup
+    ## as homozygous for AA (as in VCFs read by get_af_from_vcf.py), plus a simulated ANN consequence
+
+    if not args.outgroup:
+        return [
+                f"{args.chrom}\t{pos + 1}\t.\t{ref_allele}\t{','.join(alt_alleles)}\t.\t.\t.\tGT\t".encode()
+                for pos, ref_allele, alt_alleles, _ in sites
+                ]
+
+    n_alleles = max(len(alt_alleles) for _, _, alt_alleles, _ in sites) + 1
+    allele_counts = np.stack([(genotypes == a).sum(axis=1) + 2 * (outgroup_genotypes == a) for a in range(1, n_alleles)], axis=1)
+    AN = 2 * args.num_individuals + 2
+    prefixes = []
+    for (pos, ref_allele, alt_alleles, effect), AA, AC in zip(sites, outgroup_genotypes.tolist(), allele_counts.tolist()):
+        AA = ([ref_allele] + alt_alleles)[AA]
+        AC = ','.join([str(c) for c in AC[:len(alt_alleles)]])
+        info = f"AC={AC};AN={AN};AA={AA};ANN={alt_alleles[0]}|{effect}|"
+        prefixes.append(f"{args.chrom}\t{pos + 1}\t.\t{ref_allele}\t{','.join(alt_alleles)}\t.\t.\t{info}\tGT\t".encode())
+    return prefixes
 
-    print("##fileformat=VCFv4.2")
-    print(f"##contig=<ID={args.chrom},length={args.chromosome_length}>")
-    print(f"##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">")
-    print(f"##INFO=<ID=AA,Number=1,Type=String,Description=\"Ancestral Allele\">")
-    chrom_line = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t"
-    print(chrom_line + '\t'.join(["ingroup_" + str(i) for i in range(args.num_individuals)]))
+
+def iter_vcf_blocks(tree_sequence, args, block_size):
+    ## Reads variants of the tree sequence in blocks of block_size sites;
+    ## yields every block formatted as VCF lines (bytes). With --outgroup, sites are polarized
+    ## in the same pass and the outgroup haplotypes are not written
 
     # Randomly assign nucleotide bases A, T, G, C to alleles
     allele_bases = ['A', 'T', 'G', 'C']
 
+    n_haplotypes = 2 * args.num_individuals
+    genotypes = np.empty((block_size, n_haplotypes), dtype=np.int8)
+    outgroup_genotypes = np.zeros(block_size, dtype=np.int8)
+    sites = []
     for variant in tree_sequence.variants():
         pos = int(variant.site.position)
-        
+
         if args.atgc:
             # Randomize assignment of nucleotide bases to alleles, ensuring they are different
             alleles = random.sample(allele_bases, len(variant.alleles))
@@ -112,12 +153,259 @@ def write_vcf(tree_sequence, args):
             ref_allele = '0'
             alt_alleles = ['1']
 
-        # Write VCF entry
-        genotypes = [
-            f"{variant.genotypes[2 * i]}|{variant.genotypes[2 * i + 1]}"
-            for i in range(args.num_individuals)
-        ]
-        print(f"{args.chrom}\t{pos + 1}\t.\t{ref_allele}\t{','.join(alt_alleles)}\t.\t.\t.\tGT\t" + "\t".join(genotypes))
+        effect = None
+        if args.outgroup:
+            # Ancestral allele is the allele of the first outgroup haplotype
+            outgroup_genotypes[len(sites)] = variant.genotypes[n_haplotypes]
+            effect = 'missense_variant' if random.random() < args.missense_fraction else 'synonymous_variant'
+
+        genotypes[len(sites)] = variant.genotypes[:n_haplotypes]
+        sites.append((pos, ref_allele, alt_alleles, effect))
+        if len(sites) == block_size:
+            yield format_genotype_block(get_site_prefixes(sites, genotypes, outgroup_genotypes, args), genotypes)
+            sites = []
+    if sites:
+        n_sites = len(sites)
+        yield format_genotype_block(get_site_prefixes(sites, genotypes[:n_sites], outgroup_genotypes[:n_sites], args), genotypes[:n_sites])
+
+
+def open_output(output):
+    ## Opens binary output: stdout, a plain file or a bgzip-compressed file if it ends with .gz
+
+    if not output:
+        return sys.stdout.buffer
+    elif output.endswith('.gz'):
+        return pysam.BGZFile(output, 'wb')
+    return open(output, 'wb')
+
+
+def close_output(out, output, tabix=True):
+    ## Closes output file and tabix-indexes it if it is a bgzip-compressed VCF
+
+    if output:
+        out.close()
+        if tabix and output.endswith('.gz'):
+            pysam.tabix_index(output, preset='vcf', force=True)
+    else:
+        out.flush()
+
+
+def get_vcf_header(args, contigs):
+    ## Returns VCF header lines (bytes) with a ##contig line for every (contig, length)
+
+    header = ["##fileformat=VCFv4.2"]
+    header += [f"##contig=<ID={chrom},length={length}>" for chrom, length in contigs]
+    header += [
+              "##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">",
+              "##INFO=<ID=AA,Number=1,Type=String,Description=\"Ancestral Allele\">"
+              ]
+    if args.outgroup:
+        header += [
+                  "##INFO=<ID=AC,Number=A,Type=Integer,Description=\"Allele count in genotypes, outgroup counted as homozygous for AA\">",
+                  "##INFO=<ID=AN,Number=1,Type=Integer,Description=\"Total number of alleles, outgroup included\">",
+                  "##INFO=<ID=ANN,Number=.,Type=String,Description=\"Simulated functional annotation: Allele | Annotation\">"
+                  ]
+    header += [
+              "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + '\t'.join(["ingroup_" + str(i) for i in range(args.num_individuals)])
+              ]
+    return ('\n'.join(header) + '\n').encode()
+
+
+def write_vcf(tree_sequence, args):
+    # Write the VCF with or without ATGC genotypes in REF and ALT fileds;
+    # to stdout or to a file (bgzip-compressed and tabix-indexed if it ends with .gz)
+
+    out = open_output(args.output)
+    out.write(get_vcf_header(args, [(args.chrom, args.chromosome_length)]))
+    for block in iter_vcf_blocks(tree_sequence, args, args.block_size):
+        out.write(block)
+    close_output(out, args.output)
+
+
+def get_ingroup_samples(tree_sequence, args):
+    ## Returns sample nodes of the ingroup individuals: the first 2 * num_individuals haplotypes
+
+    return tree_sequence.samples()[:2 * args.num_individuals]
+
+
+def write_sfs(tree_sequence, args, out):
+    ## Writes the allele frequency spectrum of the ingroup computed from the tree sequence:
+    ## for the whole chromosome or in windows of --sfs-window bp;
+    ## one line per window: chrom, start, end, numbers of sites with 0..n derived alleles
+
+    length = tree_sequence.sequence_length
+    if args.sfs_window:
+        windows = np.append(np.arange(0, length, args.sfs_window), length)
+    else:
+        windows = [0, length]
+    afs = tree_sequence.allele_frequency_spectrum(
+                                                  sample_sets=[get_ingroup_samples(tree_sequence, args)],
+                                                  windows=windows,
+                                                  polarised=True,
+                                                  span_normalise=False
+                                                  )
+
+    out.write(b"#chrom\tstart\tend\tsfs\n")
+    for start, end, window_afs in zip(windows[:-1], windows[1:], afs.astype(np.int64).tolist()):
+        out.write(f"{args.chrom}\t{int(start)}\t{int(end)}\t{','.join([str(c) for c in window_afs])}\n".encode())
+
+
+def iter_derived_counts(tree_sequence, samples):
+    ## Yields (position, number of samples carrying the derived allele) of every site;
+    ## walks the trees once with samples tracked instead of decoding genotypes
+
+    for tree in tree_sequence.trees(tracked_samples=samples):
+        for site in tree.sites():
+            if site.mutations:
+                yield int(site.position), tree.num_tracked_samples(site.mutations[0].node)
+
+
+def write_sf2_input(tree_sequence, args, out):
+    ## Writes SweepFinder2 input with header: position, derived allele count x, number of ingroup alleles n, folded;
+    ## simulated sites are polarized, so folded is always 0
+
+    samples = get_ingroup_samples(tree_sequence, args)
+    n = len(samples)
+    out.write(b"position\tx\tn\tfolded\n")
+    lines = []
+    for position, x in iter_derived_counts(tree_sequence, samples):
+        if x == 0:
+            continue
+        lines.append(f"{position + 1}\t{x}\t{n}\t0\n")
+        if len(lines) == args.block_size:
+            out.write(''.join(lines).encode())
+            lines = []
+    out.write(''.join(lines).encode())
+
+
+def write_output(tree_sequence, args):
+    ## Writes VCF, or statistics computed directly from the tree sequence without VCF text
+
+    if args.output_format == 'vcf':
+        write_vcf(tree_sequence, args)
+        return
+
+    out = open_output(args.output)
+    if args.output_format == 'sfs':
+        write_sfs(tree_sequence, args, out)
+    else:
+        write_sf2_input(tree_sequence, args, out)
+    close_output(out, args.output, tabix=False)
+
+
+def get_child_seeds(random_seed, n_children):
+    ## Derives independent child seeds (msprime seed, random seed) of every replicate or contig from the master seed;
+    ## seeds depend only on the master seed and the replicate (contig) number
+
+    children = np.random.SeedSequence(random_seed).spawn(n_children)
+    return [tuple(int(s) % (2**32 - 1) + 1 for s in child.generate_state(2)) for child in children]
+
+
+def run_replicate(task):
+    ## Simulates one replicate with its own seeds; writes its output (stdout if not given) unless only the summary is asked for
+    ## and returns a summary line of the ingroup with --summary: replicate, seed, number of segregating sites, diversity, Tajima's D
+
+    args, replicate, (msprime_seed, random_seed) = task
+    args = argparse.Namespace(**{**vars(args), 'random_seed': msprime_seed})
+    random.seed(random_seed)
+    if args.bottleneck:
+        tree_sequence = simulate_bottleneck_vcf(args)
+    else:
+        tree_sequence = simulate_vcf(args)
+
+    if args.output or not args.summary:
+        args.output = args.output.format(replicate=replicate)
+        write_output(tree_sequence, args)
+    if not args.summary:
+        return None
+    samples = get_ingroup_samples(tree_sequence, args)
+    n = len(samples)
+    # sites that vary only in the outgroup are not counted
+    num_sites = sum(0 < x < n for _, x in iter_derived_counts(tree_sequence, samples))
+    diversity = tree_sequence.diversity(sample_sets=[samples])[0]
+    tajimas_D = tree_sequence.Tajimas_D(sample_sets=[samples])[0]
+    return f"{replicate}\t{msprime_seed}\t{num_sites}\t{diversity}\t{tajimas_D}"
+
+
+def run_replicates(args):
+    ## Runs replicates in a pool of processes; results do not depend on the number of processes
+    ## since every replicate has its own seeds. Summary lines are printed in replicate order
+
+    seeds = get_child_seeds(args.random_seed, args.replicates)
+    tasks = [(args, replicate, seeds[replicate]) for replicate in range(args.replicates)]
+    processes = min(args.threads, args.replicates)
+    if processes > 1:
+        pool = Pool(processes)
+        summaries = pool.imap(run_replicate, tasks)
+    else:
+        summaries = map(run_replicate, tasks)
+
+    if args.summary:
+        print("replicate\tseed\tnum_sites\tdiversity\ttajimas_D")
+    for summary in summaries:
+        if args.summary:
+            print(summary, flush=True)
+    if processes > 1:
+        pool.close()
+        pool.join()
+
+
+def read_chrom_sizes(chrom_sizes):
+    ## Reads chrom.sizes file: contig \t length; returns a list of (contig, length)
+
+    contigs = []
+    with open(chrom_sizes) as inf:
+        for line in inf:
+            if line.startswith('#') or not line.strip():
+                continue
+            chrom, length = line.split()[:2]
+            contigs.append((chrom, int(length)))
+    return contigs
+
+
+def simulate_contig(task):
+    ## Simulates one contig with its own seeds; writes its VCF lines (no header) to a temporary file
+
+    args, chrom, length, (msprime_seed, random_seed), body_file = task
+    args = argparse.Namespace(**{**vars(args), 'chrom': chrom, 'chromosome_length': length, 'random_seed': msprime_seed})
+    random.seed(random_seed)
+    if args.bottleneck:
+        tree_sequence = simulate_bottleneck_vcf(args)
+    else:
+        tree_sequence = simulate_vcf(args)
+
+    with open(body_file, 'wb') as outf:
+        for block in iter_vcf_blocks(tree_sequence, args, args.block_size):
+            outf.write(block)
+    return body_file
+
+
+def simulate_genome(args):
+    ## Simulates every contig of chrom.sizes independently in a pool of processes;
+    ## contig VCF lines are streamed from temporary files into one VCF in the chrom.sizes order
+
+    contigs = read_chrom_sizes(args.chrom_sizes)
+    seeds = get_child_seeds(args.random_seed, len(contigs))
+    out = open_output(args.output)
+    out.write(get_vcf_header(args, contigs))
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        tasks = [(args, chrom, length, seeds[i], os.path.join(tmpdir, f"{i}.vcf")) for i, (chrom, length) in enumerate(contigs)]
+        if args.threads > 1:
+            pool = Pool(args.threads)
+            body_files = pool.imap(simulate_contig, tasks)
+        else:
+            body_files = map(simulate_contig, tasks)
+
+        for body_file in body_files:
+            with open(body_file, 'rb') as inf:
+                shutil.copyfileobj(inf, out, 16 * 1024 * 1024)
+            os.remove(body_file)
+        if args.threads > 1:
+            pool.close()
+            pool.join()
+
+    close_output(out, args.output)
 
 
 def main():
@@ -135,25 +423,57 @@ def main():
     parser.add_argument("--bottleneck_size", type=int, default=1000, help="population size at bottleneck; default: 1000; \
                          if you want to simulate recent population expansion, just change bottleneck_size to a large number!")
     parser.add_argument("--bottleneck_end", type=int, default=50_000, help="when bottleneck ended, in generations; default: 50_000")
+
+    ## Add arguments to simulate an outgroup individual that polarizes the VCF
+    parser.add_argument("--outgroup", action='store_true', help="specify if you want to simulate one outgroup individual: \
+                        VCF gets AA, AC, AN and ANN in INFO, the outgroup genotypes are not written")
+    parser.add_argument("--outgroup-divergence", type=int, default=1_000_000, help="when outgroup split from the ingroup, in generations; default: 1_000_000")
+    parser.add_argument("--missense-fraction", type=float, default=0.25, help="fraction of sites annotated as missense_variant in ANN \
+                        with --outgroup, others are synonymous_variant; default: 0.25")
     
     ## Add arguments to define length and name of generated chromosome
     parser.add_argument("--chrom", type=str, default="chr1", help="chromosome name; default: chr1")
     parser.add_argument("--chromosome-length", type=int, default=2_000_000, help="Chromosome length; default: 2_000_000")
+    parser.add_argument("--chrom-sizes", type=str, default="", help="chrom.sizes file: contig \t length; simulate every contig \
+                        independently instead of one --chrom into a multi-contig VCF")
+    parser.add_argument("--tmpdir", type=str, default=None, help="directory for temporary contig files with --chrom-sizes; default: system temp dir")
 
     ## Add argument to generate real genotypes: ATGC 
     parser.add_argument("--atgc", action='store_true', help="specify if you want to generate real genotypes (A,T,G,C not just 0 or 1) in REF and ATL fileds")
 
     ## Add randomness
-    parser.add_argument("--random-seed", type=int, default=42, help="Random seed for simulation; default: 42")
-    # parser.add_argument("--output-vcf", type=str, default="simulated.vcf", help="Output VCF file name; default: simulated.vcf")
+    parser.add_argument("--random-seed", type=int, default=42, help="Master random seed: every replicate (or contig with --chrom-sizes) \
+                        is simulated with its own seeds derived from it, so replicate N is the same in any run; default: 42")
+
+    ## Add output arguments
+    parser.add_argument("--output", "--output-vcf", type=str, default="", help="Output file name; bgzip-compressed \
+                        (and tabix-indexed if VCF) if it ends with .gz; default: stdout")
+    parser.add_argument("--output-format", type=str, choices=['vcf', 'sfs', 'sf2'], default='vcf', help="vcf; \
+                        or sfs: allele frequency spectrum of the ingroup; or sf2: SweepFinder2 input with header; \
+                        sfs and sf2 are computed directly from the tree sequence; default: vcf")
+    parser.add_argument("--sfs-window", type=int, default=0, help="window size in bp for --output-format sfs; default: whole chromosome")
+    parser.add_argument("--block-size", type=int, default=1000, help="Number of sites formatted at once when writing VCF; default: 1000")
+
+    ## Add arguments to run many replicates
+    parser.add_argument("--replicates", type=int, default=1, help="Number of replicates with seeds derived from --random-seed; \
+                        --output is then a pattern with {replicate}, like sim.{replicate}.vcf.gz; default: 1")
+    parser.add_argument("--threads", type=int, default=1, help="Number of processes to run replicates or contigs; default: 1")
+    parser.add_argument("--summary", action='store_true', help="specify if you want a summary table of replicates: number of sites, diversity, Tajima's D; \
+                        without --output only the summary is written")
 
 
     args = parser.parse_args()
-    if args.bottleneck:
-        tree_sequence = simulate_bottleneck_vcf(args)
-    else:
-        tree_sequence = simulate_vcf(args)
-    write_vcf(tree_sequence, args)
+    if args.chrom_sizes:
+        if args.replicates > 1:
+            parser.error("--chrom-sizes runs a single replicate")
+        if args.output_format != 'vcf':
+            parser.error("--chrom-sizes writes VCF only")
+        simulate_genome(args)
+        return
+
+    if (args.replicates > 1) and ('{replicate}' not in args.output) and (args.output or not args.summary):
+        parser.error("--replicates needs --output with {replicate} in it or --summary")
+    run_replicates(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# This module reads per-site text files for the scripts of this repo: plain, gzip or BGZF (bgzip) input,
+# or - for stdin. Files are read in large binary blocks that end on line boundaries,
+# as pre-split byte fields of every line or as NumPy blocks of columns;
+# BGZF blocks are decompressed on several threads
+
+
+import gzip
+import io
+from multiprocessing.pool import ThreadPool
+import struct
+import sys
+import zlib
+import numpy as np
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+BUFFER_SIZE = 64 * 1024 * 1024
+BGZF_BATCH_SIZE = 256
+
+
+def detect_format(header):
+    ## Returns input format from its first bytes: bgzf (gzip with BC extra subfield), gzip or plain
+
+    if header[:2] != b'\x1f\x8b':
+        return 'plain'
+    if (len(header) >= 14) and (header[3] & 4) and (header[12:14] == b'BC'):
+        return 'bgzf'
+    return 'gzip'
+
+
+def open_raw(file_name):
+    ## Opens a file (or stdin for -) as a buffered binary stream; returns it with its format
+
+    inf = sys.stdin.buffer if file_name == '-' else open(file_name, 'rb')
+    return inf, detect_format(inf.peek(18)[:18])
+
+
+def is_plain_file(file_name):
+    ## Checks if input is an uncompressed file that can be read in byte ranges
+
+    if file_name == '-':
+        return False
+    with open(file_name, 'rb') as inf:
+        return detect_format(inf.read(18)) == 'plain'
+
+
+def inflate_bgzf_block(block):
+    ## Decompresses one BGZF block (header included) and checks its CRC and size
+
+    xlen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+    crc, size = struct.unpack('<II', block[-8:])
+    if (zlib.crc32(data) != crc) or (len(data) != size):
+        raise ValueError('corrupt BGZF block')
+    return data
+
+
+def read_bgzf_batch(inf, batch_size):
+    ## Reads up to batch_size compressed BGZF blocks, finding each block end from its BSIZE field
+
+    batch = []
+    while len(batch) < batch_size:
+        header = inf.read(12)
+        if not header:
+            break
+        if (len(header) < 12) or (header[:4] != b'\x1f\x8b\x08\x04'):
+            raise ValueError('not a BGZF block: truncated or corrupt input')
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = inf.read(xlen)
+        block_size = None
+        offset = 0
+        while offset + 4 <= len(extra):
+            subfield_length = struct.unpack('<H', extra[offset + 2:offset + 4])[0]
+            if extra[offset:offset + 2] == b'BC':
+                block_size = struct.unpack('<H', extra[offset + 4:offset + 6])[0] + 1
+            offset += 4 + subfield_length
+        if block_size is None:
+            raise ValueError('not a BGZF block: no BSIZE')
+        rest = inf.read(block_size - 12 - xlen)
+        if len(rest) < block_size - 12 - xlen:
+            raise ValueError('not a BGZF block: truncated input')
+        batch.append(header + extra + rest)
+    return batch
+
+
+def iter_bgzf(inf, threads, batch_size=BGZF_BATCH_SIZE):
+    ## Yields decompressed data of BGZF blocks in order; batches of blocks are decompressed
+    ## on a pool of threads (zlib releases the GIL) while the next batch is read
+
+    with ThreadPool(threads) as pool:
+        pending = None
+        while True:
+            batch = read_bgzf_batch(inf, batch_size)
+            if pending is not None:
+                yield b''.join(pending.get())
+            if not batch:
+                break
+            pending = pool.map_async(inflate_bgzf_block, batch)
+
+
+class ChunkReader(io.RawIOBase):
+    ## Binary stream over an iterator of byte chunks
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+
+def open_input(file_name, mode='rb', threads=1):
+    ## Opens plain, gzip or BGZF input (- for stdin) as a binary stream, or a text stream with mode rt;
+    ## BGZF is decompressed on threads if threads > 1
+
+    inf, input_format = open_raw(file_name)
+    if (input_format == 'bgzf') and (threads > 1):
+        inf = io.BufferedReader(ChunkReader(iter_bgzf(inf, threads)), buffer_size=1024 * 1024)
+    elif input_format != 'plain':
+        inf = gzip.GzipFile(fileobj=inf)
+    if mode in ('r', 'rt'):
+        return io.TextIOWrapper(inf)
+    return inf
+
+
+def read_blocks(filein, buffer_size=BUFFER_SIZE, start=0, end=None, threads=1):
+    ## Reads input (or its byte range start-end of a plain file) in large binary blocks;
+    ## yields chunks of bytes that always end on a line boundary
+
+    if start or (end is not None):
+        inf = open(filein, 'rb')
+        inf.seek(start)
+    else:
+        inf = open_input(filein, threads=threads)
+
+    remainder = b''
+    with inf:
+        to_read = end - start if end is not None else -1
+        while to_read != 0:
+            chunk = inf.read(buffer_size if to_read < 0 else min(buffer_size, to_read))
+            if not chunk:
+                break
+            if to_read > 0:
+                to_read -= len(chunk)
+            chunk = remainder + chunk
+            last_newline = chunk.rfind(b'\n')
+            if last_newline == -1:
+                remainder = chunk
+                continue
+            remainder = chunk[last_newline + 1:]
+            yield chunk[:last_newline + 1]
+    if remainder.strip():
+        yield remainder + b'\n'
+
+
+def iter_fields(filein, sep=None, buffer_size=BUFFER_SIZE, threads=1):
+    ## Yields byte fields of every non-empty line, each line split once (by whitespace or sep)
+
+    for block in read_blocks(filein, buffer_size, threads=threads):
+        for line in block.split(b'\n'):
+            if line.strip():
+                yield line.split(sep)
+
+
+def field_offsets(data):
+    ## Returns start and end offsets of the whitespace-separated fields of a block (as uint8 array)
+
+    # bytes that split() treats as whitespace: space and \t \n \x0b \x0c \r (9-13)
+    is_space = (data == ord(' ')) | ((data - np.uint8(9)) < 5)
+    is_field = ~is_space
+    starts = np.flatnonzero(is_field[1:] & is_space[:-1]) + 1
+    ends = np.flatnonzero(is_field[:-1] & is_space[1:]) + 1
+    if len(data) and is_field[0]:
+        starts = np.concatenate(([0], starts))
+    if len(data) and is_field[-1]:
+        ends = np.concatenate((ends, [len(data)]))
+    return starts, ends
+
+
+def gather_fields(data, starts, ends):
+    ## Copies fields given by their offsets into a fixed-width bytes array, byte by byte for all fields at once;
+    ## no Python object is made per field
+
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1) if len(lengths) else 1
+    gathered = np.zeros((len(starts), width), dtype=np.uint8)
+    rows = np.arange(len(starts))
+    for k in range(width):
+        rows = rows[lengths[rows] > k]
+        gathered[rows, k] = data[starts[rows] + k]
+    return gathered.view('S{}'.format(width)).ravel()
+
+
+def block_columns(block, columns):
+    ## Finds field offsets of a block of lines from its whitespace mask and copies only the requested columns;
+    ## returns a (lines x columns) array of byte fields
+
+    data = np.frombuffer(block, dtype=np.uint8)
+    starts, ends = field_offsets(data)
+    newlines = np.flatnonzero(data == ord('\n'))
+    n_lines = len(newlines)
+    line_fields = np.diff(np.searchsorted(starts, newlines), prepend=0)
+
+    if n_lines and (line_fields == line_fields[0]).all() and (n_lines * line_fields[0] == len(starts)):
+        # all lines have the same number of fields => field offsets make a (lines x fields) table
+        starts = starts.reshape(n_lines, line_fields[0])[:, columns]
+        ends = ends.reshape(n_lines, line_fields[0])[:, columns]
+        return np.stack([gather_fields(data, starts[:, c], ends[:, c]) for c in range(len(columns))], axis=1)
+    # ragged block: fall back to splitting each line
+    lines = block.splitlines()
+    return np.array([[line[c] for c in columns] for line in (line.split() for line in lines)]).reshape(len(lines), len(columns))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+# Regression tests of block parsing in compute_window_sum.py; run with pytest
+
+
+import numpy as np
+from compute_window_sum import parse_block, read_sites
+
+
+def test_parse_block_rectangular():
+    values, coordinates = parse_block(b'chr1\t1\t1.0\t9\nchr1\t2\t2.0\t8\n', [2, 3], [0, 1])
+    assert values.tolist() == [[1.0, 9.0], [2.0, 8.0]]
+    assert coordinates.tolist() == [[b'chr1', b'1'], [b'chr1', b'2']]
+
+
+def test_parse_block_mixed_whitespace():
+    values, coordinates = parse_block(b'  chr1 \t1\t1.5 nan\r\nchr10\t20  2.0\t3\n', [2, 3], [0, 1])
+    assert values[:, 0].tolist() == [1.5, 2.0]
+    assert np.isnan(values[0, 1]) and (values[1, 1] == 3.0)
+    assert coordinates.tolist() == [[b'chr1', b'1'], [b'chr10', b'20']]
+
+
+def test_parse_block_ragged_lines():
+    ## one short and one long line have the total number of fields of a rectangular block
+    values, coordinates = parse_block(b'chr1 1 1.0 9\nchr1 2 2.0\nchr1 3 3.0 7 8\n', [2], [0, 1])
+    assert values.ravel().tolist() == [1.0, 2.0, 3.0]
+    assert coordinates.tolist() == [[b'chr1', b'1'], [b'chr1', b'2'], [b'chr1', b'3']]
+
+
+def test_read_sites_ragged_lines(tmp_path):
+    filein = tmp_path / 'ragged.txt'
+    filein.write_bytes(b'chr1 1 1.0 9\nchr1 2 2.0\nchr1 3 3.0 7 8\n')
+    sites = list(read_sites(str(filein), 1024, [2], [0, 1]))
+    assert sites == [('chr1', 1, 1.0), ('chr1', 2, 2.0), ('chr1', 3, 3.0)]
+    assert np.isclose(sum(value for _, _, value in sites), 6.0)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# This script converts a polarized indexed VCF file into SweepFinder2 input:
+# one header.<chrom>.SF2.input file per contig (position x n folded) and the genome-wide
+# site frequency spectrum (.SF2.spect); records are streamed in blocks and polarized as in get_af_from_vcf.py
+
+
+import argparse
+from array import array
+from multiprocessing import Pool
+import os
+import numpy as np
+import pysam
+from get_af_from_vcf import polarize_sites
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+## Worker process state: the VCF is opened once per worker
+worker_vcf_data = None
+
+
+def init_worker(vcf):
+    ## Opens the indexed VCF once per worker process
+
+    global worker_vcf_data
+    worker_vcf_data = pysam.VariantFile(vcf)
+
+
+def new_columns():
+    ## Returns empty columns of a block of records: pos, ref, alt, AC, AN, AA
+
+    return {'pos': array('q'), 'ref': [], 'alt': [], 'AC': array('i'), 'AN': array('i'), 'AA': []}
+
+
+def to_arrays(columns):
+    ## Converts columns of a block of records to NumPy arrays, as polarize_sites expects
+
+    columns['pos'] = np.frombuffer(columns['pos'], dtype=np.int64)
+    for allele_column in ['ref', 'alt', 'AA']:
+        columns[allele_column] = np.array(columns[allele_column], dtype=bytes)
+    return columns
+
+
+def iter_site_blocks(vcf_data, contig, block_size):
+    ## Decodes records of one contig into columns, yielding blocks of at most block_size records;
+    ## only one block is kept in memory
+
+    columns = new_columns()
+    for i in vcf_data.fetch(contig):
+        info = i.info
+        columns['pos'].append(i.pos)
+        columns['ref'].append(i.ref.encode())
+        columns['alt'].append(i.alts[0].encode() if i.alts else b'')
+        columns['AC'].append(info['AC'][0] if 'AC' in info else 0)
+        columns['AN'].append(info['AN'] if 'AN' in info else 0)
+        columns['AA'].append(info['AA'].encode() if 'AA' in info else b'')
+        if len(columns['pos']) == block_size:
+            yield to_arrays(columns)
+            columns = new_columns()
+    if len(columns['pos']):
+        yield to_arrays(columns)
+
+
+def contig_to_sf2(task):
+    ## Streams sites of one contig with the worker VCF handle in blocks: every block is polarized,
+    ## its segregating sites are written to SF2 input (folded is 0 since sites are polarized)
+    ## and added to the spectrum. The SF2 input is created with the first segregating site;
+    ## returns the contig, number of sites written and its spectrum: dict n -> site counts per x
+
+    contig, sf2_input, block_size = task
+    spectrum = {}
+    n_sites = 0
+    outf = None
+    for sites in iter_site_blocks(worker_vcf_data, contig, block_size):
+        AC, AN = polarize_sites(sites)
+        # derived allele counted in the outgroup only is excluded too, as in get_sfs_by_class
+        keep = (AC != 0) & (AC < AN)
+        positions, AC, AN = sites['pos'][keep], AC[keep], AN[keep]
+        if len(positions) == 0:
+            continue
+
+        if outf is None:
+            if os.path.dirname(sf2_input):
+                os.makedirs(os.path.dirname(sf2_input), exist_ok=True)
+            outf = open(sf2_input, 'w', buffering=1024 * 1024)
+            outf.write('position\tx\tn\tfolded\n')
+        outf.writelines(
+                        '{}\t{}\t{}\t0\n'.format(position, x, n)
+                        for position, x, n in zip(positions.tolist(), AC.tolist(), AN.tolist())
+                        )
+        n_sites += len(positions)
+
+        for n in np.unique(AN).tolist():
+            counts = np.bincount(AC[AN == n], minlength=n + 1)
+            spectrum[n] = spectrum[n] + counts if n in spectrum else counts
+
+    if outf is not None:
+        outf.close()
+    return contig, n_sites, spectrum
+
+
+def write_spect(spectrum, spect_file):
+    ## Writes site frequency spectrum: x \t n \t proportion of sites with n alleles that have x derived alleles
+
+    if os.path.dirname(spect_file):
+        os.makedirs(os.path.dirname(spect_file), exist_ok=True)
+    with open(spect_file, 'w') as outf:
+        for n in sorted(spectrum):
+            counts = spectrum[n]
+            for x, proportion in enumerate((counts / counts.sum()).tolist()):
+                outf.write('{}\t{}\t{:.6e}\n'.format(x, n, proportion))
+
+
+def vcf_to_sf2(vcf, contigs, sf2_pattern, threads, block_size=100_000):
+    ## Converts every contig in a pool of processes, each reading its contig from the indexed VCF;
+    ## returns the genome-wide spectrum summed over contigs and contigs with SF2 input
+
+    tasks = [(contig, sf2_pattern.format(chrom=contig), block_size) for contig in contigs]
+    if threads > 1:
+        pool = Pool(threads, initializer=init_worker, initargs=(vcf,))
+        results = pool.imap(contig_to_sf2, tasks)
+    else:
+        init_worker(vcf)
+        results = map(contig_to_sf2, tasks)
+
+    spectrum = {}
+    converted = []
+    for contig, n_sites, contig_spectrum in results:
+        print('{}\t{}'.format(contig, n_sites))
+        if n_sites:
+            converted.append(contig)
+        for n, counts in contig_spectrum.items():
+            spectrum[n] = spectrum[n] + counts if n in spectrum else counts
+    if threads > 1:
+        pool.close()
+        pool.join()
+    return spectrum, converted
+
+
+def main():
+    ## Parse argument
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                        '-v',
+                        '--vcf',
+                        type=str,
+                        help='polarized indexed VCF with AC, AN and AA (outgroup included in AC/AN)'
+                        )
+    parser.add_argument(
+                        '-c',
+                        '--chroms',
+                        type=str,
+                        default='',
+                        help='chrom.sizes file: chrom \t length; convert only these contigs; default=all VCF contigs'
+                        )
+    parser.add_argument(
+                        '-m',
+                        '--min_length',
+                        type=int,
+                        default=0,
+                        help='with --chroms, only contigs longer than this are converted; default=0'
+                        )
+    parser.add_argument(
+                        '-o',
+                        '--output',
+                        type=str,
+                        default='{chrom}/header.{chrom}.SF2.input',
+                        help='output path pattern of SF2 input with {chrom}; default={chrom}/header.{chrom}.SF2.input'
+                        )
+    parser.add_argument(
+                        '-s',
+                        '--spect',
+                        type=str,
+                        default='genome.SF2.spect',
+                        help='genome-wide spectrum file; default=genome.SF2.spect'
+                        )
+    parser.add_argument(
+                        '-S',
+                        '--chrom_spect',
+                        type=str,
+                        default='{chrom}/{chrom}.SF2.spect',
+                        help='path pattern with {chrom} to also write the genome-wide spectrum for every contig, \
+                        as SF2 jobs of write_split_SF2_jobs.py expect; empty to skip; default={chrom}/{chrom}.SF2.spect'
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--threads',
+                        type=int,
+                        default=1,
+                        help='number of processes for contigs; default=1'
+                        )
+    parser.add_argument(
+                        '-b',
+                        '--block_size',
+                        type=int,
+                        default=100_000,
+                        help='number of VCF records polarized and written at once; default=100_000'
+                        )
+    args = parser.parse_args()
+
+    ## Contigs of the VCF (optionally only listed and long enough)
+    with pysam.VariantFile(args.vcf) as vcf_data:
+        contigs = list(vcf_data.header.contigs)
+    if args.chroms:
+        chroms = set()
+        with open(args.chroms) as inf:
+            for line in inf:
+                if line.startswith('#') or not line.strip():
+                    continue
+                chrom, length = line.split()[:2]
+                if int(length) > args.min_length:
+                    chroms.add(chrom)
+        contigs = [c for c in contigs if c in chroms]
+
+    ## Write SF2 input of every contig, then the spectrum of all sites
+    spectrum, converted = vcf_to_sf2(args.vcf, contigs, args.output, args.threads, args.block_size)
+    write_spect(spectrum, args.spect)
+    if args.chrom_spect:
+        for contig in converted:
+            write_spect(spectrum, args.chrom_spect.format(chrom=contig))
+
+
+if __name__ == "__main__":
+    main()
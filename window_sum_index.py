@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+#
+# This script builds a binary prefix-sum index for a large file: chr \t position \t value1 \t value2..
+# (same input as compute_window_sum.py) and answers window or bed region queries from it
+# with two lookups per window instead of re-reading the text file
+
+
+import argparse
+import os
+import numpy as np
+from compute_window_sum import parse_block
+from site_reader import read_blocks
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+def get_run_bounds(chroms):
+    ## Returns start and end indices of runs of the same contig in a block
+
+    change = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(chroms)]))
+    return starts, ends
+
+
+def build_index(filein, index_dir, check_columns, position_columns, buffer_size):
+    ## Streams the input once and writes to index_dir:
+    ## positions.bin: int64 site positions, all contigs one after another;
+    ## cumsum.<column>.bin: float64 cumulative sums of every value column (nan as 0), starting from 0 at every contig;
+    ## nan.<column>.bin: int64 indices in positions.bin of sites with nan in this column;
+    ## contigs.tsv: contig, number of sites, offset in positions.bin, offset in cumsum files
+
+    os.makedirs(index_dir, exist_ok=True)
+    positions_out = open(os.path.join(index_dir, 'positions.bin'), 'wb')
+    cumsum_outs = [open(os.path.join(index_dir, 'cumsum.{}.bin'.format(c + 1)), 'wb') for c in check_columns]
+    nan_outs = [open(os.path.join(index_dir, 'nan.{}.bin'.format(c + 1)), 'wb') for c in check_columns]
+
+    contigs = []
+    seen_chroms = set()
+    chrom_current = None
+    position_previous = 0
+    running_sums = np.zeros(len(check_columns))
+    n_sites = 0
+
+    for block in read_blocks(filein, buffer_size):
+        values, coordinates = parse_block(block, check_columns, position_columns)
+        chroms = coordinates[:, 0]
+        positions = coordinates[:, 1].astype(np.int64)
+
+        for start, end in zip(*get_run_bounds(chroms)):
+            chrom = chroms[start].decode()
+            if chrom != chrom_current:
+                ## new contig: prefix sums start over from 0
+                if chrom in seen_chroms:
+                    raise ValueError('input is not grouped by contig: {} is split'.format(chrom))
+                seen_chroms.add(chrom)
+                contigs.append([chrom, 0, n_sites, n_sites + len(contigs)])
+                chrom_current = chrom
+                position_previous = 0
+                running_sums[:] = 0
+                for out in cumsum_outs:
+                    np.zeros(1).tofile(out)
+
+            run_positions = positions[start:end]
+            if (run_positions[0] < position_previous) or np.any(np.diff(run_positions) < 0):
+                raise ValueError('input is not sorted by position in contig {}'.format(chrom))
+            position_previous = run_positions[-1]
+            run_positions.tofile(positions_out)
+
+            ## nan adds nothing to its column; sites with nan are recorded per column,
+            ## so that a query drops them only for the columns it asks for
+            run_values = values[start:end]
+            is_nan = np.isnan(run_values)
+            run_values = np.where(is_nan, 0.0, run_values)
+            for c, (cumsum_out, nan_out) in enumerate(zip(cumsum_outs, nan_outs)):
+                (running_sums[c] + np.cumsum(run_values[:, c])).tofile(cumsum_out)
+                (n_sites + np.flatnonzero(is_nan[:, c])).tofile(nan_out)
+            running_sums += run_values.sum(axis=0)
+
+            contigs[-1][1] += end - start
+            n_sites += end - start
+
+    for out in [positions_out] + cumsum_outs + nan_outs:
+        out.close()
+    with open(os.path.join(index_dir, 'contigs.tsv'), 'w') as outf:
+        for contig in contigs:
+            outf.write('\t'.join([str(i) for i in contig]) + '\n')
+
+
+def load_index(index_dir, check_columns):
+    ## Memory-maps the index: returns a dict contig -> (positions, [cumsum per column], sites with nan in any column);
+    ## nan sites are indices within the contig
+
+    positions = np.memmap(os.path.join(index_dir, 'positions.bin'), dtype=np.int64, mode='r')
+    cumsums = []
+    nan_sites = []
+    for c in check_columns:
+        cumsum_file = os.path.join(index_dir, 'cumsum.{}.bin'.format(c + 1))
+        nan_file = os.path.join(index_dir, 'nan.{}.bin'.format(c + 1))
+        if not os.path.exists(cumsum_file):
+            raise ValueError('column {} is not in the index {}'.format(c + 1, index_dir))
+        if not os.path.exists(nan_file):
+            raise ValueError('index {} has no nan sites of column {}: build it again'.format(index_dir, c + 1))
+        cumsums.append(np.memmap(cumsum_file, dtype=np.float64, mode='r'))
+        nan_sites.append(np.fromfile(nan_file, dtype=np.int64))
+    # a site is not informative if any of the queried columns is nan
+    nan_sites = np.unique(np.concatenate(nan_sites)) if nan_sites else np.zeros(0, dtype=np.int64)
+
+    index = {}
+    with open(os.path.join(index_dir, 'contigs.tsv')) as inf:
+        for line in inf:
+            chrom, n_sites, site_offset, cumsum_offset = line.split()
+            n_sites, site_offset, cumsum_offset = int(n_sites), int(site_offset), int(cumsum_offset)
+            nan_lo, nan_hi = np.searchsorted(nan_sites, [site_offset, site_offset + n_sites])
+            index[chrom] = (
+                            positions[site_offset:site_offset + n_sites],
+                            [cumsum[cumsum_offset:cumsum_offset + n_sites + 1] for cumsum in cumsums],
+                            nan_sites[nan_lo:nan_hi] - site_offset
+                            )
+    return index
+
+
+def query_windows(contig_index, starts, ends):
+    ## Returns sums and counts of informative sites in windows (start, end] of one contig:
+    ## two binary searches and two lookups per window. Sites with nan in some of the queried columns
+    ## are taken out of the count, and their values in the other columns out of the sum
+
+    positions, cumsums, nan_sites = contig_index
+    lo = np.searchsorted(positions, starts, side='right')
+    hi = np.searchsorted(positions, ends, side='right')
+    window_sums = np.zeros(len(starts))
+    for cumsum in cumsums:
+        window_sums += cumsum[hi] - cumsum[lo]
+
+    nan_lo = np.searchsorted(nan_sites, lo)
+    nan_hi = np.searchsorted(nan_sites, hi)
+    window_counts = (hi - lo) - (nan_hi - nan_lo)
+    if (len(cumsums) > 1) and len(nan_sites):
+        nan_values = np.zeros(len(nan_sites))
+        for cumsum in cumsums:
+            nan_values += cumsum[nan_sites + 1] - cumsum[nan_sites]
+        nan_cumsum = np.concatenate(([0.0], np.cumsum(nan_values)))
+        window_sums -= nan_cumsum[nan_hi] - nan_cumsum[nan_lo]
+    return window_sums, window_counts
+
+
+def print_windows(chrom, starts, ends, window_sums, window_counts):
+    ## Writes chrom \t start \t end \t sum \t mean \t count
+
+    for start, end, window_sum, window_count in zip(starts.tolist(), ends.tolist(), window_sums.tolist(), window_counts.tolist()):
+        if window_count:
+            print('{}\t{}\t{}\t{}\t{}\t{}'.format(chrom, start, end, window_sum, window_sum / window_count, window_count))
+        else:
+            print('{}\t{}\t{}\t0.0\tNA\t0'.format(chrom, start, end))
+
+
+def query_index(index, window, step, bed):
+    ## Reports sum, mean and count either in windows of <window> bp sliding by <step> bp
+    ## over every contig (like compute_window_sum.py --units bp), or in regions of a bed file
+
+    print('#chrom\tstart\tend\tsum\tmean\tcount')
+    if bed:
+        with open(bed) as inf:
+            for line in inf:
+                if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                    continue
+                chrom, start, end = line.split()[:3]
+                starts = np.array([int(start)])
+                ends = np.array([int(end)])
+                if chrom in index:
+                    window_sums, window_counts = query_windows(index[chrom], starts, ends)
+                else:
+                    window_sums, window_counts = np.zeros(1), np.zeros(1, dtype=np.int64)
+                print_windows(chrom, starts, ends, window_sums, window_counts)
+    else:
+        for chrom, contig_index in index.items():
+            positions = contig_index[0]
+            if len(positions) == 0:
+                continue
+            starts = np.arange(0, positions[-1], step)
+            ends = starts + window
+            window_sums, window_counts = query_windows(contig_index, starts, ends)
+            print_windows(chrom, starts, ends, window_sums, window_counts)
+
+
+def main():
+    ## Parse argument
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='build index from a chr \t position \t values.. file')
+    build_parser.add_argument(
+                        '-i',
+                        '--input',
+                        type=str,
+                        help='input file with at least a numeric column; sorted by contig and position'
+                        )
+    build_parser.add_argument(
+                        '-c',
+                        '--columns',
+                        type=str,
+                        default='3',
+                        help='comma-separated string of column numbers to index'
+                        )
+    build_parser.add_argument(
+                        '-p',
+                        '--position',
+                        type=str,
+                        default='1,2',
+                        help='comma-separated string of column numbers specifying coordinates: chrom,position'
+                        )
+    build_parser.add_argument(
+                        '-b',
+                        '--buffer_size',
+                        type=int,
+                        default=64,
+                        help='size of input blocks in MB; default=64'
+                        )
+
+    query_parser = subparsers.add_parser('query', help='compute window or region sums from an index')
+    query_parser.add_argument(
+                        '-c',
+                        '--columns',
+                        type=str,
+                        default='3',
+                        help='comma-separated string of indexed column numbers to compute sum/mean across'
+                        )
+    query_parser.add_argument(
+                        '-w',
+                        '--window',
+                        type=int,
+                        default=1000,
+                        help='window size in bp; default=1000'
+                        )
+    query_parser.add_argument(
+                        '-s',
+                        '--step',
+                        type=int,
+                        default=0,
+                        help='step in bp for sliding windows; default=window size'
+                        )
+    query_parser.add_argument(
+                        '-r',
+                        '--regions',
+                        type=str,
+                        default='',
+                        help='bed file with regions to query instead of windows'
+                        )
+
+    for subparser in [build_parser, query_parser]:
+        subparser.add_argument(
+                        '-x',
+                        '--index',
+                        type=str,
+                        required=True,
+                        help='index directory'
+                        )
+    args = parser.parse_args()
+
+    check_columns = [int(c) - 1 for c in args.columns.split(',')]
+    if args.command == 'build':
+        position_columns = [int(c) - 1 for c in args.position.split(',')]
+        if len(position_columns) != 2:
+            raise ValueError('index needs two position columns: chrom,position')
+        build_index(args.input, args.index, check_columns, position_columns, args.buffer_size * 1024 * 1024)
+    else:
+        index = load_index(args.index, check_columns)
+        step = args.step if args.step else args.window
+        query_index(index, args.window, step, args.regions)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,12 @@ it also makes links to the fastq and genome files in corresponding dirs.
 '''
 
 import argparse
+import gzip
+from multiprocessing.pool import ThreadPool
 import re
 import sys
 import os
+import zlib
 
 
 
@@ -47,18 +50,73 @@ def make_file_links(file_list, datadir):
     os.chdir(wdir)
 
 
-def get_ids_from_sample_list(file_list, extensions):
-    ## Parses the list of file names and returns lists of IDs
-    ## (removes extensions)
+def get_sample_id(file_name, extensions):
+    ## Returns sample ID of a fastq file: file name without extensions and without _1/_2 (_R1/_R2) suffix
 
-    id_list = [f.split('/')[-1] for f in file_list]
+    sample_id = file_name.split('/')[-1]
     for ext in extensions:
-        id_list = [i.replace(ext, '') for i in id_list]
-    id_list = list(set([re.sub('_[a-zA-Z]?2$', '', re.sub('_[a-zA-Z]?1$', '', i)) for i in id_list]))
-    return id_list
+        sample_id = sample_id.replace(ext, '')
+    return re.sub('_[a-zA-Z]?2$', '', re.sub('_[a-zA-Z]?1$', '', sample_id))
 
 
-def write_samples_file(id_list, file_list, ref_path, name_sci, project, assembly_ref, srx):
+def index_sample_files(file_list, extensions):
+    ## Builds a dict: sample ID -> sorted list of its fastq files (R1, R2), sorted by sample ID;
+    ## files are assigned by their exact sample ID, so S1 does not get files of S10
+
+    sample_index = {}
+    for f in file_list:
+        sample_index.setdefault(get_sample_id(f, extensions), []).append(f)
+    return {sample_id: sorted(sample_index[sample_id]) for sample_id in sorted(sample_index)}
+
+
+def count_fastq_reads(fastq):
+    ## Reads a fastq file to the end (decompressing it if gzipped) and counts its reads;
+    ## returns (file, number of reads, error message or '' if the file is intact)
+
+    n_lines = 0
+    last_byte = b'\n'
+    opener = gzip.open if fastq.endswith('.gz') else open
+    try:
+        with opener(fastq, 'rb') as inf:
+            while True:
+                block = inf.read(4 * 1024 * 1024)
+                if not block:
+                    break
+                n_lines += block.count(b'\n')
+                last_byte = block[-1:]
+    except (OSError, EOFError, zlib.error) as e:
+        return fastq, n_lines // 4, str(e) if str(e) else type(e).__name__
+    if last_byte != b'\n':
+        n_lines += 1
+    if n_lines % 4:
+        return fastq, n_lines // 4, 'number of lines is not a multiple of 4: {}'.format(n_lines)
+    return fastq, n_lines // 4, ''
+
+
+def validate_fastq_files(sample_index, threads, read_counts_file):
+    ## Checks integrity of every fastq file in a pool of threads and counts its reads;
+    ## writes sample,fq,reads,error to read_counts_file and returns a list of problems
+    ## (broken files and R1/R2 pairs with different numbers of reads)
+
+    fastq_files = [f for files in sample_index.values() for f in files]
+    with ThreadPool(threads) as pool:
+        results = {fastq: (n_reads, error) for fastq, n_reads, error in pool.imap_unordered(count_fastq_reads, fastq_files)}
+
+    problems = []
+    with open(read_counts_file, 'w') as outf:
+        outf.write('sample,fq,reads,error\n')
+        for sample_id, files in sample_index.items():
+            for f in files:
+                n_reads, error = results[f]
+                outf.write('{},{},{},{}\n'.format(sample_id, f, n_reads, error.replace(',', ';')))
+                if error:
+                    problems.append('{}: {}'.format(f, error))
+            if (len(files) == 2) and not any(results[f][1] for f in files) and (results[files[0]][0] != results[files[1]][0]):
+                problems.append('{}: R1 and R2 have different numbers of reads: {}, {}'.format(sample_id, results[files[0]][0], results[files[1]][0]))
+    return problems
+
+
+def write_samples_file(sample_index, ref_path, name_sci, project, assembly_ref, srx):
     ## Writes to stdout; uses format:
     ## BioSample,LibraryName,refGenome,Run,Organism,BioProject,fq1,fq2,refGenome
 
@@ -70,9 +128,8 @@ def write_samples_file(id_list, file_list, ref_path, name_sci, project, assembly
     srx_1 = int(re.sub('SRX+', '', srx))
 
     # write samples
-    for i in range(len(id_list)):        
-        sample_id = id_list[i]
-        fq_files = ','.join(sorted([f for f in file_list if sample_id in f]))
+    for i, sample_id in enumerate(sample_index):
+        fq_files = ','.join(sample_index[sample_id])
         samples_info = '{},{}'.format(sample_id, sample_id)
         srx_i = 'SRX' + '0' * (n_digit - len(str(srx_1 + i))) + str(srx_1 + i)
         ref_info = '{},{},{},{}'.format(assembly_ref, srx_i, name_sci, project)
@@ -133,6 +190,26 @@ def main():
                         default='SRX00000001',
                         help="SRX ID of the first sample (like SRX15327220) if known; default: SRX0000000$i"
                         )
+    parser.add_argument(
+                        '-v',
+                        '--validate',
+                        action='store_true',
+                        help="specify if you want to check every fastq file (gzip integrity, complete reads) and count reads before writing samples"
+                        )
+    parser.add_argument(
+                        '-t',
+                        '--threads',
+                        type=int,
+                        default=1,
+                        help="Number of threads to check fastq files with --validate; default: 1"
+                        )
+    parser.add_argument(
+                        '-c',
+                        '--read_counts',
+                        type=str,
+                        default='read_counts.csv',
+                        help="Output file with read counts of every fastq with --validate; default: read_counts.csv"
+                        )
     args = parser.parse_args()
 
 
@@ -150,7 +227,14 @@ def main():
     ## Parse fastq files -> get sample IDs
     extensions = ['.gz', '.fastq', '.fq']
     file_list = parse_dir_files(fastq_dir, extensions)
-    id_list = get_ids_from_sample_list(file_list, extensions)
+
+
+    ## Check fastq files before anything else; stop if some are broken
+    if args.validate:
+        problems = validate_fastq_files(index_sample_files(file_list, extensions), args.threads, args.read_counts)
+        if problems:
+            sys.stderr.write('\n'.join(problems) + '\n')
+            sys.exit(1)
 
 
     ## Make symbolic links to reseq fastq files in data/local_fastq
@@ -164,7 +248,8 @@ def main():
     ## Write samples lines in snpArcher-prefered format
     local_file_list = [os.getcwd() + '/' + local_fastq + f.split('/')[-1] for f in file_list]
     local_ref_path = os.getcwd() + '/' + local_ref + '/' + ref_path.split('/')[-1]
-    write_samples_file(id_list, local_file_list, local_ref_path, name_sci, project, assembly_ref, srx)
+    sample_index = index_sample_files(local_file_list, extensions)
+    write_samples_file(sample_index, local_ref_path, name_sci, project, assembly_ref, srx)
 
 
 if __name__ == "__main__":
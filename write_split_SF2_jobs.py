@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# This script splits SweepFinder2 input of every large chromosome into chunks
+# and writes job scripts to run SweepFinder2 on them (with and without recombination map)
+
+
+import argparse
+import glob
+import os
+import sys
+
+
+__author__ = "Ekaterina Osipova, 2026."
+
+
+SF2_HEADER = 'position\tx\tn\tfolded\n'
+
+## Files of a chromosome written by this script (chunks, job scripts and their logs)
+## and by its SweepFinder2 jobs (chunk outputs)
+GENERATED_PATTERNS = ['{0}/header.{0}.SF2.input_*', '{0}/sbatch.{0}.*.sh', '{0}/sbatch.{0}.*.sh.log']
+OUTPUT_PATTERNS = ['{0}/header.{0}.SF2.*.out', '{0}/norecmap.header.{0}.SF2.*.out']
+
+
+def read_chrom_sizes(chrom_sizes, min_length):
+    ## Reads chrom.sizes file: contig \t length; returns a list of (contig, length) longer than min_length
+
+    contigs = []
+    with open(chrom_sizes) as inf:
+        for line in inf:
+            if line.startswith('#') or not line.strip():
+                continue
+            chrom, length = line.split()[:2]
+            if int(length) > min_length:
+                contigs.append((chrom, int(length)))
+    return contigs
+
+
+def split_sf2_input(sf2_input, chunk_lines, chunk_bp):
+    ## Splits SF2 input in one pass: every chunk file gets the header as it is written;
+    ## chunks have chunk_lines sites, or cover chunk_bp of the chromosome if chunk_bp is set.
+    ## Returns chunk labels: <sf2_input>_<label> are the chunk files
+
+    labels = []
+    outf = None
+    chunk_current = None
+    n_sites = 0
+    with open(sf2_input) as inf:
+        for line in inf:
+            if not line[0].isdigit():
+                # header or empty line
+                continue
+            if chunk_bp:
+                chunk = (int(line.split('\t', 1)[0]) - 1) // chunk_bp
+            else:
+                chunk = n_sites // chunk_lines
+            n_sites += 1
+
+            if chunk != chunk_current:
+                if outf:
+                    outf.close()
+                labels.append('{:04d}'.format(len(labels) + 1))
+                outf = open('{}_{}'.format(sf2_input, labels[-1]), 'w', buffering=1024 * 1024)
+                outf.write(SF2_HEADER)
+                chunk_current = chunk
+            outf.write(line)
+    if outf:
+        outf.close()
+    return labels
+
+
+def write_job_script(script, template, command):
+    ## Writes a job script: template (sbatch header) followed by the command
+
+    with open(script, 'w') as outf:
+        outf.write(template)
+        if template and not template.endswith('\n'):
+            outf.write('\n')
+        outf.write(command + '\n')
+
+
+def plan_jobs(contigs, recmap, template, grid, chunk_lines, chunk_bp):
+    ## Splits inputs and writes job scripts; returns jobs as (job id, job ids it depends on, script, input, output).
+    ## The recombination maps of all chromosomes are made by one job that SweepFinder2 jobs with map depend on;
+    ## chromosomes without SF2 input are skipped
+
+    jobs = []
+    if recmap:
+        command = 'fill_in_coord_gaps.py -f {} -o {{chrom}}/{{chrom}}.recombination_map.txt'.format(recmap)
+        write_job_script('sbatch.recomb.sh', template, command)
+        jobs.append(('recomb', [], 'sbatch.recomb.sh', recmap, ''))
+
+    for chrom, _ in contigs:
+        sf2_input = '{0}/header.{0}.SF2.input'.format(chrom)
+        spect = '{0}/{0}.SF2.spect'.format(chrom)
+        if not os.path.exists(sf2_input):
+            # vcf_to_SF2.py writes no input for a contig without segregating sites
+            sys.stderr.write('no SF2 input for {}: {} is skipped\n'.format(chrom, sf2_input))
+            continue
+        for label in split_sf2_input(sf2_input, chunk_lines, chunk_bp):
+            chunk = '{}_{}'.format(sf2_input, label)
+
+            script = '{0}/sbatch.{0}.{1}.sweepfinder.norecmap.sh'.format(chrom, label)
+            output = '{0}/norecmap.header.{0}.SF2.{1}.out'.format(chrom, label)
+            write_job_script(script, template, 'SweepFinder2 -lg {} {} {} {}'.format(grid, chunk, spect, output))
+            jobs.append(('{}.{}.norecmap'.format(chrom, label), [], script, chunk, output))
+
+            if recmap:
+                script = '{0}/sbatch.{0}.{1}.sweepfinder.sh'.format(chrom, label)
+                output = '{0}/header.{0}.SF2.{1}.out'.format(chrom, label)
+                recombination_map = '{0}/{0}.recombination_map.txt'.format(chrom)
+                write_job_script(script, template, 'SweepFinder2 -lrg {} {} {} {} {}'.format(grid, chunk, spect, recombination_map, output))
+                jobs.append(('{}.{}'.format(chrom, label), ['recomb'], script, chunk, output))
+    return jobs
+
+
+def find_stale_files(contigs, jobs):
+    ## Finds files of an earlier split that are not part of the planned jobs, like chunks
+    ## with other labels (or the line number suffixes of the old awk split);
+    ## returns stale generated files and stale SweepFinder2 outputs
+
+    planned = set()
+    for _, _, script, input_file, output in jobs:
+        planned.update([script, script + '.log', input_file, output])
+    stale_generated = []
+    stale_outputs = []
+    for chrom, _ in contigs:
+        for pattern in GENERATED_PATTERNS:
+            stale_generated += [f for f in sorted(glob.glob(pattern.format(chrom))) if f not in planned]
+        for pattern in OUTPUT_PATTERNS:
+            stale_outputs += [f for f in sorted(glob.glob(pattern.format(chrom))) if f not in planned]
+    return stale_generated, stale_outputs
+
+
+def write_manifest(jobs, manifest):
+    ## Writes jobs table: job \t depends_on (comma-separated or .) \t script \t input \t output
+
+    with open(manifest, 'w') as outf:
+        outf.write('job\tdepends_on\tscript\tinput\toutput\n')
+        for job, depends, script, input_file, output in jobs:
+            outf.write('{}\t{}\t{}\t{}\t{}\n'.format(job, ','.join(depends) if depends else '.', script, input_file, output if output else '.'))
+
+
+def print_sbatch(jobs):
+    ## Prints sbatch commands; jobs with dependencies start after their dependencies finish
+
+    for job, depends, script, _, _ in jobs:
+        variable = 'job_' + job.replace('.', '_')
+        dependency = ''
+        if depends:
+            dependency = '--dependency=afterok:{} '.format(':'.join(['${job_' + d.replace('.', '_') + '}' for d in depends]))
+        print('{}=$(sbatch --parsable {}{})'.format(variable, dependency, script))
+
+
+def main():
+    ## Parse argument
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                        '-c',
+                        '--chroms',
+                        type=str,
+                        help='chrom.sizes file: chrom \t length; inputs are <chrom>/header.<chrom>.SF2.input'
+                        )
+    parser.add_argument(
+                        '-r',
+                        '--recmap',
+                        type=str,
+                        default='',
+                        help='genome-wide recombination map (plain or gzipped): chrom, position, .., rate; \
+                        if not given, only jobs without recombination map are written'
+                        )
+    parser.add_argument(
+                        '-m',
+                        '--min_length',
+                        type=int,
+                        default=1_000_000,
+                        help='only chromosomes longer than this are used; default=1_000_000'
+                        )
+    parser.add_argument(
+                        '-T',
+                        '--template',
+                        type=str,
+                        default='template_sbatch.sh',
+                        help='sbatch header that every job script starts with; default=template_sbatch.sh'
+                        )
+    parser.add_argument(
+                        '-g',
+                        '--grid',
+                        type=int,
+                        default=1000,
+                        help='SweepFinder2 grid spacing in bp (-lg/-lrg); default=1000'
+                        )
+    split_group = parser.add_mutually_exclusive_group()
+    split_group.add_argument(
+                        '-l',
+                        '--chunk_lines',
+                        type=int,
+                        default=250_000,
+                        help='number of sites per chunk; default=250_000'
+                        )
+    split_group.add_argument(
+                        '-b',
+                        '--chunk_bp',
+                        type=int,
+                        default=0,
+                        help='split chunks by coordinate: chunk size in bp, so every job has the same number of grid points'
+                        )
+    split_group.add_argument(
+                        '-p',
+                        '--chunk_grid_points',
+                        type=int,
+                        default=0,
+                        help='split chunks by coordinate: number of grid points per job'
+                        )
+    parser.add_argument(
+                        '-o',
+                        '--manifest',
+                        type=str,
+                        default='SF2_jobs.tsv',
+                        help='output table of jobs with dependencies; default=SF2_jobs.tsv'
+                        )
+    parser.add_argument(
+                        '-x',
+                        '--clean',
+                        action='store_true',
+                        help='specify if you want to remove SweepFinder2 outputs of chunks that are not in the new split; \
+                        by default the script refuses to plan jobs next to them, since merge_SF2_outputs.py would merge them too'
+                        )
+    args = parser.parse_args()
+
+    ## Read template once
+    template = ''
+    if os.path.exists(args.template):
+        with open(args.template) as inf:
+            template = inf.read()
+
+    ## Split inputs, write job scripts, the jobs table and sbatch commands
+    chunk_bp = args.chunk_bp if args.chunk_bp else args.chunk_grid_points * args.grid
+    contigs = read_chrom_sizes(args.chroms, args.min_length)
+    jobs = plan_jobs(contigs, args.recmap, template, args.grid, args.chunk_lines, chunk_bp)
+
+    ## Remove chunks and job scripts of an earlier split; outputs of its chunks only with --clean
+    stale_generated, stale_outputs = find_stale_files(contigs, jobs)
+    for f in stale_generated:
+        os.remove(f)
+    if stale_outputs and not args.clean:
+        sys.stderr.write('{} SweepFinder2 outputs of an earlier split are not in the new jobs, like {}; '
+                         'remove them or run with --clean\n'.format(len(stale_outputs), stale_outputs[0]))
+        sys.exit(1)
+    for f in stale_outputs:
+        os.remove(f)
+    write_manifest(jobs, args.manifest)
+    print_sbatch(jobs)
+
+
+if __name__ == "__main__":
+    main()